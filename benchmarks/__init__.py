@@ -0,0 +1,9 @@
+import sys
+from importlib.util import find_spec
+from pathlib import Path
+
+CODE_DIR = Path(__file__).resolve().parents[1] / "code"
+
+# Working tree benchmarked when the package is not installed (asv run --python=same)
+if find_spec("brainweb_tdcs") is None:
+    sys.path.append(str(CODE_DIR))
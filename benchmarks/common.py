@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+
+
+def use_bundled_data() -> None:
+    os.environ.setdefault("BRAINWEB_TDCS_DATA_DIR", str(DATA_DIR))
+
+
+def get_trace(n_categories: int = 5, chains: int = 4, draws: int = 1000, seed: int = 0):
+    import arviz as az
+
+    # Posterior shaped as the ones of the categorical models of the notebooks
+    rng = np.random.default_rng(seed)
+    posterior = {
+        "Intercept": rng.normal(100, 5, (chains, draws)),
+        "C(p_id)": rng.normal(0, 10, (chains, draws, n_categories)),
+        "e_sigma": rng.gamma(10, 2, (chains, draws)),
+    }
+    coords = {"C(p_id)_dim": list(range(1, n_categories + 1))}
+    dims = {"C(p_id)": ["C(p_id)_dim"]}
+    return az.from_dict(posterior=posterior, coords=coords, dims=dims)
+
+
+def get_summary(trace) -> pd.DataFrame:
+    import arviz as az
+
+    # Same statistics as the summaries of the notebooks
+    stat_funcs = {
+        "mean": np.mean,
+        "std": np.std,
+        "2.5%": lambda x: np.percentile(x, 2.5),
+        "97.5%": lambda x: np.percentile(x, 97.5),
+    }
+    return az.summary(trace, stat_funcs=stat_funcs, extend=False)
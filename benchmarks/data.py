@@ -0,0 +1,67 @@
+import numpy as np
+
+from brainweb_tdcs import EXPERIMENTS
+
+from .common import use_bundled_data
+
+
+class ExperimentDataSuite:
+
+    params = ([False, True], [False, True])
+    param_names = ["use_cache", "compact"]
+
+    def setup(self, use_cache, compact):
+        use_bundled_data()
+        self.experiment = EXPERIMENTS[0]
+        # Cache filled beforehand so that only the hits are timed
+        self.experiment.get_data(use_cache)
+
+    def time_get_data(self, use_cache, compact):
+        self.experiment.get_data(use_cache, compact)
+
+    def time_get_gpr_data(self, use_cache, compact):
+        self.experiment.get_gpr_data(use_cache, compact)
+
+    def track_memory_usage(self, use_cache, compact):
+        data = self.experiment.get_data(use_cache, compact)
+        return int(data.memory_usage(deep=True).sum())
+
+    track_memory_usage.unit = "bytes"
+
+
+class CompactStatisticsSuite:
+
+    params = (list(range(len(EXPERIMENTS))), ["fem", "gpr"], [False, True])
+    param_names = ["experiment", "variant", "use_cache"]
+
+    def setup(self, experiment, variant, use_cache):
+        use_bundled_data()
+        e = EXPERIMENTS[experiment]
+        load = e.get_gpr_data if variant == "gpr" else e.get_data
+        self.data = load(False, False)
+        self.compact_data = load(use_cache, True)
+
+    def track_statistics_mismatches(self, experiment, variant, use_cache):
+        # Statistics of the VOIs computed by the notebooks, which must not depend on
+        # the dtypes, the groups included
+        mismatches = 0
+        for column in ["sub", "p", "k", "p_id", "k_id"]:
+            for voi in ["e", "e_r"]:
+                expected = self.data.groupby(column).describe()[voi]
+                actual = self.compact_data.groupby(column).describe()[voi]
+                if not actual.index.equals(expected.index):
+                    mismatches += expected.size
+                    continue
+                mismatches += int(
+                    (
+                        ~np.isclose(actual, expected, rtol=0, atol=0, equal_nan=True)
+                    ).sum()
+                )
+            if column in ["p", "k"]:
+                expected = list(self.data[column].unique())
+                mismatches += expected != list(self.compact_data[column].unique())
+        if mismatches:
+            raise AssertionError(f"{mismatches} statistics differ in compact mode.")
+        return mismatches
+
+    track_statistics_mismatches.unit = "statistics"
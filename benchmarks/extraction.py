@@ -0,0 +1,46 @@
+import tempfile
+
+from brainweb_tdcs.extraction import (
+    connect,
+    extract_experiments_results,
+    fetch_experiments_results,
+    stream_experiments_statistics,
+)
+from brainweb_tdcs.synthetic import create_synthetic_database
+
+EXPERIMENTS = [("MC", "C3", "C4"), ("MC", "C3", "Fp2")]
+N_ELEMENTS = [100, 1000]
+
+
+class ExtractionSuite:
+
+    timeout = 600
+    params = N_ELEMENTS
+    param_names = ["n_elements"]
+
+    def setup_cache(self):
+        # Written in the working directory of the benchmarks, kept between them
+        for n_elements in N_ELEMENTS:
+            create_synthetic_database(
+                f"full_records_{n_elements}.duckdb",
+                EXPERIMENTS,
+                n_elements=n_elements,
+                threads=1,
+            )
+
+    def setup(self, n_elements):
+        self.db_path = f"full_records_{n_elements}.duckdb"
+        self.conn = connect(self.db_path, threads=1)
+
+    def teardown(self, n_elements):
+        self.conn.close()
+
+    def time_fetch_experiments_results(self, n_elements):
+        fetch_experiments_results(self.conn, EXPERIMENTS)
+
+    def time_stream_experiments_statistics(self, n_elements):
+        stream_experiments_statistics(self.conn, EXPERIMENTS)
+
+    def time_extract_experiments_results(self, n_elements):
+        with tempfile.TemporaryDirectory() as output_dir:
+            extract_experiments_results(self.db_path, EXPERIMENTS, output_dir, 1)
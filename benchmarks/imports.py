@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+from . import CODE_DIR
+
+# Dependencies loaded on first use only, each of them takes up to seconds to import
+LAZY_MODULES = ("arviz", "bambi", "chaospy", "IPython", "pymc3", "scipy", "sklearn")
+
+
+class ImportSuite:
+
+    params = ["brainweb_tdcs", "brainweb_tdcs.study", "brainweb_tdcs.plot"]
+    param_names = ["module"]
+
+    def timeraw_import(self, module):
+        # Fresh interpreter for each sample, importing the installed package if any
+        return f"import {module}", f"import sys; sys.path.append({str(CODE_DIR)!r})"
+
+    def track_lazy_modules_loaded(self, module):
+        code = (
+            f"import sys; sys.path.append({str(CODE_DIR)!r}); import {module}; "
+            f"print(sum(m in sys.modules for m in {LAZY_MODULES!r}))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        return int(output.stdout)
+
+    track_lazy_modules_loaded.unit = "modules"
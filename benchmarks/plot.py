@@ -0,0 +1,89 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+
+from brainweb_tdcs import EXPERIMENTS
+from brainweb_tdcs.plot import (
+    get_violin_statistics,
+    plot_conductivity_categorical,
+    plot_density,
+    plot_placement,
+    plot_placement_categorical,
+    plot_posterior,
+    plot_subject,
+)
+from brainweb_tdcs.posterior import kde
+
+from .common import get_summary, get_trace, use_bundled_data
+
+
+class ViolinSuite:
+
+    params = ["sub", "k", "p"]
+    param_names = ["by"]
+
+    def setup(self, by):
+        use_bundled_data()
+        self.data = EXPERIMENTS[0].get_data(use_cache=False)
+
+    def time_get_violin_statistics(self, by):
+        get_violin_statistics(self.data["e"], self.data[by])
+
+
+class PlotSuite:
+    def setup(self):
+        use_bundled_data()
+        self.experiment = EXPERIMENTS[0]
+        self.data = self.experiment.get_data(use_cache=False)
+        self.fig, self.ax = plt.subplots()
+
+    def teardown(self):
+        plt.close("all")
+
+    def time_plot_density(self):
+        plot_density(self.ax, self.data["e"], self.experiment, "", "")
+
+    def time_plot_placement(self):
+        plot_placement(self.ax, "e", "p_x", self.experiment, self.data, "", "")
+
+    def time_plot_placement_categorical(self):
+        plot_placement_categorical(self.ax, "e", self.experiment, self.data, "", "")
+
+    def time_plot_conductivity_categorical(self):
+        plot_conductivity_categorical(self.ax, "e", self.experiment, self.data, "", "")
+
+    def time_plot_subject(self):
+        plot_subject(self.ax, "e", self.experiment, self.data, "", "")
+
+
+class PosteriorSuite:
+    def setup(self):
+        self.experiment = EXPERIMENTS[0]
+        self.trace = get_trace()
+        self.summary = get_summary(self.trace)
+        self.samples = self.trace.posterior["C(p_id)"].values.reshape(-1, 5).T
+        self.fig, self.ax = plt.subplots()
+
+    def teardown(self):
+        plt.close("all")
+
+    def time_kde(self):
+        kde(self.samples, bw_fct=2.5)
+
+    def time_plot_posterior(self):
+        # Densities are computed on the first call only, as in the notebooks
+        for i, name in enumerate(self.summary.index[1:-1]):
+            plot_posterior(
+                self.ax,
+                self.experiment,
+                self.trace,
+                self.summary,
+                "C(p_id)",
+                "",
+                "",
+                i,
+                summary_param=name,
+                rope_width=1,
+            )
@@ -0,0 +1,57 @@
+from brainweb_tdcs import EXPERIMENTS
+from brainweb_tdcs.study import fit_model, get_fit_key, summarize
+
+from .common import get_trace, use_bundled_data
+
+# Few draws, the notebooks use 1000 draws of 4 chains
+DRAWS = 200
+CHAINS = 2
+FORMULAS = {"pooled": "e ~ C(p_id)", "hierarchic": "e ~ C(p_id) + (C(p_id) | sub)"}
+
+
+def get_model(structure):
+    import bambi as bmb
+
+    use_bundled_data()
+    data = EXPERIMENTS[0].get_data(use_cache=False)[["sub", "p", "p_id", "e", "e_r"]]
+    return bmb.Model(FORMULAS[structure], data)
+
+
+class FitModelSuite:
+
+    timeout = 1800
+    params = (["conjugate", "advi", "nuts"], list(FORMULAS))
+    param_names = ["backend", "structure"]
+
+    def setup(self, backend, structure):
+        if backend == "conjugate" and structure != "pooled":
+            raise NotImplementedError
+        self.model = get_model(structure)
+
+    def time_fit_model(self, backend, structure):
+        fit_model(
+            self.model,
+            draws=DRAWS,
+            chains=CHAINS,
+            random_seed=1234,
+            backend=backend,
+            use_cache=False,
+            cores=1,
+            progressbar=False,
+        )
+
+
+class FitKeySuite:
+    def setup(self):
+        self.model = get_model("hierarchic")
+
+    def time_get_fit_key(self):
+        get_fit_key(self.model, draws=DRAWS, chains=CHAINS, random_seed=1234)
+
+
+class SummarizeSuite:
+    def setup(self):
+        self.trace = get_trace()
+
+    def time_summarize(self):
+        summarize(self.trace, use_cache=False)
@@ -0,0 +1,82 @@
+import tempfile
+
+import numpy as np
+
+from brainweb_tdcs import EXPERIMENTS, TISSUES
+from brainweb_tdcs.experiments import CONDUCTIVITY_COLUMNS
+from brainweb_tdcs.surrogate import VOIS, fit_surrogate
+
+from .common import use_bundled_data
+
+# Same sampling of the conductivities as generate_gpr_files
+N_PROFILES = 20
+RANDOM_SEED = 1234
+
+
+class GprGenerationSuite:
+
+    timeout = 600
+
+    def setup_cache(self):
+        use_bundled_data()
+        data = EXPERIMENTS[0].get_data(use_cache=False)
+        surrogate = fit_surrogate(data, VOIS, n_jobs=1, use_cache=False)
+        return data, surrogate
+
+    def setup(self, cache):
+        import chaospy as cp
+
+        dist = cp.J(*[cp.Uniform(0, 1) for _ in range(len(TISSUES))])
+        self.cdfs = dist.sample(N_PROFILES, rule="halton", seed=RANDOM_SEED)
+        self.kappas = np.stack(
+            [t.ppf(cdf) for cdf, t in zip(self.cdfs, TISSUES.values())], axis=1
+        )
+
+    def time_ppf(self, cache):
+        for cdf, tissue in zip(self.cdfs, TISSUES.values()):
+            tissue.ppf(cdf)
+
+    def time_fit_surrogate(self, cache):
+        data, _ = cache
+        fit_surrogate(data, VOIS, n_jobs=1, use_cache=False)
+
+    def time_predict(self, cache):
+        _, surrogate = cache
+        surrogate.predict(self.kappas)
+
+    def time_predict_at(self, cache):
+        data, surrogate = cache
+        kappas = data[CONDUCTIVITY_COLUMNS].values
+        surrogate.predict_at(kappas, data["sub"].values, data["p"].values)
+
+
+class GprFilesSuite:
+
+    params = [1, 2]
+    param_names = ["n_workers"]
+    number = 1
+    repeat = 1
+    timeout = 1200
+
+    def setup(self, n_workers):
+        try:
+            from brainweb_tdcs.surrogate import generate_gpr_files
+        except ImportError:
+            # Skipped on the commits before the single job generation
+            raise NotImplementedError
+        use_bundled_data()
+        self.generate_gpr_files = generate_gpr_files
+        self.paths = [e.data_path for e in EXPERIMENTS]
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def teardown(self, n_workers):
+        self.output_dir.cleanup()
+
+    def time_generate_gpr_files(self, n_workers):
+        self.generate_gpr_files(
+            self.paths,
+            self.output_dir.name,
+            random_seed=RANDOM_SEED,
+            n_workers=n_workers,
+            use_cache=False,
+        )
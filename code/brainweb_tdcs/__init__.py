@@ -1,4 +1,4 @@
-from .exceptions import MissingEnvironmentVariable
+from .exceptions import MissingEnvironmentVariable, ReportError
 from .rois import ROIS, RegionOfInterest
 from .experiments import EXPERIMENTS, Experiment
 from .tissues import TISSUES, Tissue
@@ -8,6 +8,7 @@ __all__ = [
     "EXPERIMENTS",
     "MissingEnvironmentVariable",
     "RegionOfInterest",
+    "ReportError",
     "ROIS",
     "Tissue",
     "TISSUES",
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .exceptions import MissingEnvironmentVariable
+from .profiling import profiled
+
+CACHE_VERSION = 3
+
+
+def is_enabled(name: str) -> bool:
+    return os.environ.get(name, "0").lower() in ("1", "true", "yes")
+
+
+def use_cache_by_default() -> bool:
+    return is_enabled("BRAINWEB_TDCS_USE_CACHE")
+
+
+def get_cache_dir(name: str) -> Path:
+    try:
+        data_dir = os.environ["BRAINWEB_TDCS_DATA_DIR"]
+        return Path(data_dir) / "cache" / name
+    except KeyError:
+        raise MissingEnvironmentVariable(
+            "Missing 'BRAINWEB_TDCS_DATA_DIR' environment variable."
+        )
+
+
+def get_cache_path(path: Path) -> Path:
+    # <data_dir>/<kind>/<name>.csv -> <data_dir>/cache/<kind>/<name>
+    return path.parent.parent / "cache" / path.parent.name / path.stem
+
+
+def hash_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evict(directory: Path, max_size: int) -> None:
+    # Least recently used first, cache hits refresh the modification time
+    files = []
+    for path in Path(directory).iterdir():
+        if path.is_file() and path.suffix != ".tmp":
+            try:
+                files.append((path.stat(), path))
+            except FileNotFoundError:
+                continue
+    files.sort(key=lambda f: f[0].st_mtime_ns)
+    size = sum(stat.st_size for stat, _ in files)
+    for stat, path in files:
+        if size <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        size -= stat.st_size
+
+
+def get_categories(values: pd.Series) -> np.ndarray:
+    # Sorted as the groups of the object and integer columns, the categoricals being
+    # ordered so that the sorts and comparisons do not depend on the dtypes
+    return np.sort(values.unique())
+
+
+def compact_dtypes(
+    df: pd.DataFrame, categories: Iterable[str] = (), float32: Iterable[str] = ()
+) -> pd.DataFrame:
+    # Same categories and float32 columns as the cache, with the smallest integers
+    # for the ids, the other columns being left untouched
+    categories, float32 = set(categories), set(float32)
+    data = {}
+    for name in df.columns:
+        values = df[name]
+        if name in categories:
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = pd.Categorical(
+                    values, categories=get_categories(values), ordered=True
+                )
+        elif name in float32:
+            values = values.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast="integer")
+        data[name] = values
+    return pd.DataFrame(data, index=df.index, copy=False)
+
+
+@profiled("data.read_csv", rows="return", labels=["path"])
+def read_csv(
+    path: Path,
+    categories: Iterable[str] = (),
+    float32: Iterable[str] = (),
+    use_cache: Optional[bool] = None,
+) -> pd.DataFrame:
+    if use_cache is None:
+        use_cache = use_cache_by_default()
+    if not use_cache:
+        return pd.read_csv(path, sep=";")
+    categories, float32 = list(categories), list(float32)
+    cache_path = get_cache_path(Path(path))
+    meta = _get_valid_meta(path, cache_path)
+    if meta is None:
+        meta = _write_cache(path, cache_path, categories, float32)
+    try:
+        return _read_cache(cache_path, meta)
+    except FileNotFoundError:
+        # Replaced by a concurrent writer since the metadata was read
+        df = pd.read_csv(path, sep=";")
+        return _decode(*_encode(df, categories, float32))
+
+
+def _get_source_stamp(path: Path) -> dict:
+    stat = os.stat(path)
+    return dict(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+
+
+def _get_unique_name() -> str:
+    # Sorted by creation time
+    return f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex}"
+
+
+def _write_meta(meta_path: Path, meta: dict) -> None:
+    tmp_path = meta_path.with_name(f".{meta_path.name}.{_get_unique_name()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _get_valid_meta(path: Path, cache_path: Path) -> Optional[dict]:
+    meta_path = cache_path / "meta.json"
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    stamp = _get_source_stamp(path)
+    if meta["source"]["stamp"] == stamp:
+        return meta
+    # Touched but possibly unchanged file (e.g. datalad get, git checkout)
+    if meta["source"]["sha256"] != hash_file(path):
+        return None
+    meta["source"]["stamp"] = stamp
+    _write_meta(meta_path, meta)
+    return meta
+
+
+def _encode(
+    df: pd.DataFrame, categories: list, float32: list
+) -> Tuple[List[dict], List[np.ndarray]]:
+    columns, arrays = [], []
+    for i, name in enumerate(df.columns):
+        column = dict(name=name, file=f"{i:03d}.npy")
+        values = df[name]
+        if name in categories:
+            levels = get_categories(values)
+            values = pd.Categorical(values, categories=levels, ordered=True)
+            column["categories"] = levels.tolist()
+            values = values.codes
+        elif name in float32:
+            # Conductivities are stored as float32 upstream
+            values = values.values.astype(np.float32)
+        else:
+            values = values.values
+        columns.append(column)
+        arrays.append(np.ascontiguousarray(values))
+    return columns, arrays
+
+
+def _decode(columns: List[dict], arrays: List[np.ndarray]) -> pd.DataFrame:
+    data = {}
+    for column, values in zip(columns, arrays):
+        if "categories" in column:
+            values = pd.Categorical.from_codes(
+                values, categories=column["categories"], ordered=True
+            )
+        data[column["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def _write_cache(path: Path, cache_path: Path, categories: list, float32: list) -> dict:
+    # <cache_path>/meta.json points to the directory of the arrays, each writer
+    # fills its own directory and publishes it by replacing the metadata
+    df = pd.read_csv(path, sep=";")
+    columns, arrays = _encode(df, categories, float32)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    name = _get_unique_name()
+    tmp_path = cache_path / f".{name}.tmp"
+    tmp_path.mkdir()
+    for column, values in zip(columns, arrays):
+        np.save(tmp_path / column["file"], values)
+    tmp_path.rename(cache_path / name)
+    meta = dict(
+        version=CACHE_VERSION,
+        source=dict(
+            name=Path(path).name,
+            stamp=_get_source_stamp(path),
+            sha256=hash_file(path),
+        ),
+        data=name,
+        columns=columns,
+    )
+    _write_meta(cache_path / "meta.json", meta)
+    # Previous versions, readers which still use them fall back to the CSV file,
+    # the published version and the ones of later writers are kept
+    with open(cache_path / "meta.json") as f:
+        published = json.load(f).get("data")
+    for other in cache_path.iterdir():
+        if other.name.startswith(".") or other.name in ("meta.json", published):
+            continue
+        if other.name >= name:
+            continue
+        if other.is_dir():
+            shutil.rmtree(other, ignore_errors=True)
+        else:
+            other.unlink(missing_ok=True)
+    return meta
+
+
+def _read_cache(cache_path: Path, meta: dict) -> pd.DataFrame:
+    data_path = cache_path / meta["data"]
+    arrays = [np.load(data_path / c["file"], mmap_mode="r") for c in meta["columns"]]
+    return _decode(meta["columns"], arrays)
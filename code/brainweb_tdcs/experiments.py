@@ -2,10 +2,27 @@ import os
 from dataclasses import dataclass, field
 from email.policy import default
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
+import numpy as np
 import pandas as pd
+from numpy.typing import ArrayLike
 
 from . import ROIS, MissingEnvironmentVariable, RegionOfInterest
+from .cache import compact_dtypes, read_csv
+
+if TYPE_CHECKING:
+    from .surrogate import Surrogate
+
+CATEGORICAL_COLUMNS = ["sub", "k", "p"]
+CONDUCTIVITY_COLUMNS = ["k_wm", "k_gm", "k_csf", "k_skl", "k_sft"]
+
+
+def _read_data(path: Path, use_cache: Optional[bool], compact: bool) -> pd.DataFrame:
+    df = read_csv(path, CATEGORICAL_COLUMNS, CONDUCTIVITY_COLUMNS, use_cache)
+    if compact:
+        df = compact_dtypes(df, CATEGORICAL_COLUMNS, CONDUCTIVITY_COLUMNS)
+    return df
 
 
 @dataclass
@@ -34,11 +51,54 @@ class Experiment:
                 "Missing 'BRAINWEB_TDCS_DATA_DIR' environment variable."
             )
 
-    def get_data(self) -> pd.DataFrame:
-        return pd.read_csv(self.data_path, sep=";")
-    
-    def get_gpr_data(self) -> pd.DataFrame:
-        return pd.read_csv(str(self.data_path).replace(".csv", "_gpr.csv"), sep=";")
+    @property
+    def gpr_data_path(self) -> Path:
+        return self.data_path.with_name(self.data_file_name.replace(".csv", "_gpr.csv"))
+
+    def get_data(
+        self, use_cache: Optional[bool] = None, compact: bool = False
+    ) -> pd.DataFrame:
+        return _read_data(self.data_path, use_cache, compact)
+
+    def get_gpr_data(
+        self, use_cache: Optional[bool] = None, compact: bool = False
+    ) -> pd.DataFrame:
+        return _read_data(self.gpr_data_path, use_cache, compact)
+
+    def get_surrogate(self, **kwargs) -> "Surrogate":
+        from .surrogate import fit_surrogate
+
+        return fit_surrogate(self.get_data(), **kwargs)
+
+    def predict(
+        self,
+        kappas: ArrayLike,
+        subs: Optional[ArrayLike] = None,
+        placements: Optional[ArrayLike] = None,
+        **kwargs,
+    ) -> pd.DataFrame:
+        if (subs is None) != (placements is None):
+            raise ValueError("Subjects and placements must be given together.")
+        surrogate = self.get_surrogate(**kwargs)
+        kappas = np.atleast_2d(kappas)
+        if subs is None and placements is None:
+            # Every subject and placement for each conductivity profile
+            n_v, n_p, n_s = surrogate.shape
+            y = surrogate.predict(kappas).transpose(0, 3, 2, 1).reshape(-1, n_v)
+            df = pd.DataFrame(
+                np.repeat(kappas, n_p * n_s, axis=0), columns=CONDUCTIVITY_COLUMNS
+            )
+            df.insert(0, "sub", np.tile(np.repeat(surrogate.subs, n_p), len(kappas)))
+            df["p"] = np.tile(surrogate.placements, n_s * len(kappas))
+        else:
+            subs = np.broadcast_to(subs, len(kappas))
+            placements = np.broadcast_to(placements, len(kappas))
+            y = surrogate.predict_at(kappas, subs, placements)
+            df = pd.DataFrame(kappas, columns=CONDUCTIVITY_COLUMNS)
+            df.insert(0, "sub", subs)
+            df["p"] = placements
+        df[surrogate.vois] = y
+        return df
 
 
 EXPERIMENTS = [
@@ -0,0 +1,398 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from .profiling import add_rows, profiled
+
+ExperimentSpec = Tuple[str, str, str]
+
+ANODE_SUFFIXES = ("", "A", "P", "C", "L")
+CONDUCTIVITY_PROFILES = ["reference"] + [f"halton_{i + 1}" for i in range(20)]
+DIRECTIONS = {
+    "": "reference",
+    "A": "anterior",
+    "C": "central",
+    "L": "lateral",
+    "P": "posterior",
+}
+COORDINATES = np.array([(0, 0), (0, 1), (1, 0), (-1, 0), (0, -1)])
+TISSUE_COLUMNS = ["wm", "gm", "csf", "skl", "sft"]
+FIELD_COLUMNS = [
+    "e",
+    "e_x",
+    "e_y",
+    "e_z",
+    "e_r",
+    "e_t",
+    "j",
+    "j_x",
+    "j_y",
+    "j_z",
+    "j_r",
+    "j_t",
+]
+EXPERIMENT_COLUMNS = [
+    "sub",
+    "k",
+    "k_id",
+    *[f"k_{t}" for t in TISSUE_COLUMNS],
+    "p",
+    "p_id",
+    "p_x",
+    "p_y",
+    "v",
+    *FIELD_COLUMNS,
+]
+ROI_COLUMNS = ["sub", "x", "y", "z", "area", "volume", "depth"]
+STATISTICS_FIELDS = ["e", "e_r", "e_t"]
+STATISTICS_PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def connect(
+    db_path: Union[str, Path], threads: int = 8, memory_limit: str = "8GB"
+) -> duckdb.DuckDBPyConnection:
+    conn = duckdb.connect(str(db_path), read_only=True)
+    conn.execute(f"PRAGMA threads={int(threads)}")
+    conn.execute(f"PRAGMA memory_limit='{memory_limit}'")
+    return conn
+
+
+def get_experiments_filter(n_experiments: int) -> str:
+    # One placeholder group per experiment: roi, cathode and the anode placements
+    anodes = ", ".join(["?"] * len(ANODE_SUFFIXES))
+    return " OR ".join(
+        [f"(roi = ? AND cathode = ? AND anode IN ({anodes}))"] * n_experiments
+    )
+
+
+def get_experiments_parameters(experiments: Iterable[ExperimentSpec]) -> list:
+    parameters = []
+    for roi, anode, cathode in experiments:
+        parameters += [roi, cathode, *[f"{anode}{s}" for s in ANODE_SUFFIXES]]
+    return parameters
+
+
+@profiled("extraction.experiments_results", rows="return")
+def fetch_experiments_results(
+    conn: duckdb.DuckDBPyConnection, experiments: List[ExperimentSpec]
+) -> pd.DataFrame:
+    tissues = ",\n".join([f"avg({t}) AS k_{t}" for t in TISSUE_COLUMNS])
+    fields = ",\n".join([f"avg(abs({f})) * 1000 AS {f}" for f in FIELD_COLUMNS])
+    return conn.execute(
+        f"""
+        SELECT
+            roi,
+            cathode,
+            subject AS sub,
+            anode,
+            (conductivity_profile + 1) % 21 AS k_id,
+            {tissues},
+            avg(v) * 1000 AS v,
+            {fields}
+        FROM full_records AS r
+        LEFT JOIN
+            conductivity_profiles AS c
+        ON
+            r.conductivity_profile = c.id
+        WHERE
+            {get_experiments_filter(len(experiments))}
+        GROUP BY
+            roi,
+            subject,
+            anode,
+            cathode,
+            conductivity_profile
+        """,
+        get_experiments_parameters(experiments),
+    ).fetchdf()
+
+
+def format_experiment_results(
+    df: pd.DataFrame, anode: str, columns: Sequence[str] = EXPERIMENT_COLUMNS
+) -> pd.DataFrame:
+    df = df.copy()
+    # Format conductivity
+    k_id = df["k_id"].values.astype(np.int8)
+    df["k_id"] = pd.Categorical.from_codes(k_id, categories=list(range(21)))
+    df["k"] = pd.Categorical.from_codes(k_id, categories=CONDUCTIVITY_PROFILES)
+    # Format placement, only decoding the few distinct anode names
+    anodes = pd.Categorical(df["anode"])
+    suffixes = list(DIRECTIONS)
+    lookup = np.array(
+        [suffixes.index(a[len(anode) : len(anode) + 1]) for a in anodes.categories],
+        dtype=np.int8,
+    )
+    p_id = lookup[anodes.codes]
+    df["p"] = pd.Categorical.from_codes(p_id, categories=list(DIRECTIONS.values()))
+    df["p_id"] = pd.Categorical.from_codes(p_id, categories=list(range(5)))
+    df["p_x"], df["p_y"] = COORDINATES[p_id].T
+    # Format final df
+    return df[list(columns)].sort_values(by=["sub", "k_id", "p_id"])
+
+
+def extract_experiments_results(
+    db_path: Union[str, Path],
+    experiments: Iterable[ExperimentSpec],
+    output_dir: Union[str, Path] = ".",
+    threads: int = 8,
+    memory_limit: str = "8GB",
+) -> List[Path]:
+    experiments = [tuple(e) for e in experiments]
+    conn = connect(db_path, threads, memory_limit)
+    df = fetch_experiments_results(conn, experiments)
+    # Fan the results out into one CSV file per experiment
+    paths = []
+    for roi, anode, cathode in experiments:
+        anodes = [f"{anode}{s}" for s in ANODE_SUFFIXES]
+        mask = (
+            (df["roi"] == roi) & (df["cathode"] == cathode) & df["anode"].isin(anodes)
+        )
+        path = Path(output_dir) / f"roi-{roi}_anode-{anode}_cathode-{cathode}.csv"
+        format_experiment_results(df[mask], anode).to_csv(path, sep=";", index=False)
+        paths.append(path)
+    return paths
+
+
+@profiled("extraction.rois_results", rows="return")
+def fetch_rois_results(
+    conn: duckdb.DuckDBPyConnection, rois: List[str]
+) -> pd.DataFrame:
+    names = ", ".join(["?"] * len(rois))
+    return conn.execute(
+        f"""
+        SELECT
+            name AS roi,
+            subject AS sub,
+            x, y, z,
+            area,
+            volume,
+            depth
+        FROM full_roi_profiles
+        WHERE name IN ({names})
+        ORDER BY subject
+        """,
+        rois,
+    ).fetchdf()
+
+
+def extract_rois_results(
+    db_path: Union[str, Path],
+    rois: Iterable[str],
+    output_dir: Union[str, Path] = ".",
+    threads: int = 8,
+    memory_limit: str = "8GB",
+) -> List[Path]:
+    rois = [str(roi) for roi in rois]
+    conn = connect(db_path, threads, memory_limit)
+    df = fetch_rois_results(conn, rois)
+    # Save one CSV file per ROI
+    paths = []
+    for roi in rois:
+        path = Path(output_dir) / f"roi-{roi}.csv"
+        df.loc[df["roi"] == roi, ROI_COLUMNS].to_csv(path, sep=";", index=False)
+        paths.append(path)
+    return paths
+
+
+class StreamingStatistics:
+    def __init__(
+        self,
+        n_fields: int,
+        n_bins: int = 1024,
+        value_range: Tuple[float, float] = (1e-6, 1e3),
+    ) -> None:
+        self.n_fields = n_fields
+        self.n_bins = n_bins
+        # Log-spaced bins bound the relative error of the percentiles, the first
+        # and last bins collect the values out of the range
+        self.edges = np.geomspace(*value_range, n_bins - 1)
+        self.keys: Dict[tuple, int] = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros((0, n_fields))
+        self.m2 = np.zeros((0, n_fields))
+        self.min = np.zeros((0, n_fields))
+        self.max = np.zeros((0, n_fields))
+        self.hist = np.zeros((0, n_fields, n_bins), dtype=np.int64)
+
+    def _get_group_ids(self, keys: pd.DataFrame) -> np.ndarray:
+        # Only the few distinct keys of the batch are looked up in Python
+        batch_ids, uniques = pd.MultiIndex.from_frame(keys).factorize()
+        lookup = np.empty(len(uniques), dtype=np.int64)
+        for i, key in enumerate(uniques):
+            lookup[i] = self.keys.setdefault(key, len(self.keys))
+        self._grow(len(self.keys))
+        return lookup[batch_ids]
+
+    def _grow(self, n_groups: int) -> None:
+        n_new = n_groups - self.count.size
+        if n_new <= 0:
+            return
+        shape = (n_new, self.n_fields)
+        self.count = np.concatenate((self.count, np.zeros(n_new, dtype=np.int64)))
+        self.mean = np.concatenate((self.mean, np.zeros(shape)))
+        self.m2 = np.concatenate((self.m2, np.zeros(shape)))
+        self.min = np.concatenate((self.min, np.full(shape, np.inf)))
+        self.max = np.concatenate((self.max, np.full(shape, -np.inf)))
+        self.hist = np.concatenate(
+            (self.hist, np.zeros((*shape, self.n_bins), dtype=np.int64))
+        )
+
+    def update(self, keys: pd.DataFrame, values: np.ndarray) -> None:
+        # Accumulated over the groups of the batch only, whatever the number of
+        # groups seen so far
+        groups, gid = np.unique(self._get_group_ids(keys), return_inverse=True)
+        n_groups = groups.size
+        # Batch moments per group
+        count = np.bincount(gid, minlength=n_groups)
+        sums = np.stack([np.bincount(gid, v, n_groups) for v in values.T], axis=1)
+        mean = sums / count[:, np.newaxis]
+        deviations = values - mean[gid]
+        m2 = np.stack(
+            [np.bincount(gid, d**2, n_groups) for d in deviations.T], axis=1
+        )
+        # Merge with the running moments (Chan et al.)
+        n_a, n_b = self.count[groups, np.newaxis], count[:, np.newaxis]
+        n = n_a + n_b
+        delta = mean - self.mean[groups]
+        self.mean[groups] += delta * n_b / n
+        self.m2[groups] += m2 + delta**2 * n_a * n_b / n
+        self.count[groups] += count
+        # Extrema from the values sorted by group
+        order = np.argsort(gid, kind="stable")
+        starts = np.flatnonzero(np.r_[True, np.diff(gid[order]) != 0])
+        sorted_values = values[order]
+        self.min[groups] = np.minimum(
+            self.min[groups], np.minimum.reduceat(sorted_values, starts, axis=0)
+        )
+        self.max[groups] = np.maximum(
+            self.max[groups], np.maximum.reduceat(sorted_values, starts, axis=0)
+        )
+        # Histograms
+        bins = np.searchsorted(self.edges, values)
+        flat = (gid[:, np.newaxis] * self.n_fields + np.arange(self.n_fields)) * (
+            self.n_bins
+        ) + bins
+        size = n_groups * self.n_fields * self.n_bins
+        self.hist[groups] += np.bincount(flat.ravel(), minlength=size).reshape(
+            n_groups, self.n_fields, self.n_bins
+        )
+
+    def percentiles(self, q: Sequence[float]) -> np.ndarray:
+        # Use the geometric center of the bin holding each percentile
+        centers = np.sqrt(self.edges[1:] * self.edges[:-1])
+        centers = np.concatenate(([self.edges[0]], centers, [self.edges[-1]]))
+        cdf = np.cumsum(self.hist, axis=-1)
+        targets = np.asarray(q)[:, np.newaxis, np.newaxis] / 100 * cdf[..., -1]
+        out = np.empty((len(q), *self.hist.shape[:2]))
+        for i, target in enumerate(targets):
+            idx = (cdf < target[..., np.newaxis]).sum(axis=-1)
+            out[i] = centers[np.minimum(idx, self.n_bins - 1)]
+        # Percentiles cannot fall out of the observed extrema
+        return np.clip(out, self.min, self.max)
+
+    def to_frame(
+        self,
+        key_names: Sequence[str],
+        fields: Sequence[str],
+        percentiles: Sequence[float],
+        scale: float = 1.0,
+    ) -> pd.DataFrame:
+        df = pd.DataFrame(list(self.keys), columns=list(key_names))
+        variance = self.m2 / np.maximum(self.count[:, np.newaxis] - 1, 1)
+        quantiles = self.percentiles(percentiles)
+        for i, field in enumerate(fields):
+            names = iter(get_statistics_columns([field], percentiles))
+            df[next(names)] = self.mean[:, i] * scale
+            df[next(names)] = variance[:, i] * scale**2
+            df[next(names)] = self.min[:, i] * scale
+            df[next(names)] = self.max[:, i] * scale
+            for values in quantiles:
+                df[next(names)] = values[:, i] * scale
+        df["n"] = self.count
+        return df
+
+
+def get_statistics_columns(
+    fields: Sequence[str], percentiles: Sequence[float]
+) -> List[str]:
+    suffixes = ["", "_var", "_min", "_max", *[f"_p{q:02g}" for q in percentiles]]
+    return [f"{field}{suffix}" for field in fields for suffix in suffixes]
+
+
+@profiled("extraction.experiments_statistics")
+def stream_experiments_statistics(
+    conn: duckdb.DuckDBPyConnection,
+    experiments: List[ExperimentSpec],
+    fields: Sequence[str] = STATISTICS_FIELDS,
+    percentiles: Sequence[float] = STATISTICS_PERCENTILES,
+    n_bins: int = 1024,
+    batch_size: int = 1000000,
+) -> pd.DataFrame:
+    key_names = ["roi", "cathode", "sub", "anode", "k_id"]
+    columns = ", ".join([f"abs({f}) AS {f}" for f in fields])
+    reader = conn.execute(
+        f"""
+        SELECT
+            roi,
+            cathode,
+            subject AS sub,
+            anode,
+            (conductivity_profile + 1) % 21 AS k_id,
+            {columns}
+        FROM full_records
+        WHERE
+            {get_experiments_filter(len(experiments))}
+        """,
+        get_experiments_parameters(experiments),
+    ).fetch_record_batch(batch_size)
+    stats = StreamingStatistics(len(fields), n_bins)
+    for batch in reader:
+        add_rows(batch.num_rows)
+        df = batch.to_pandas()
+        stats.update(df[key_names], df[list(fields)].values.astype(np.float64))
+    df = stats.to_frame(key_names, fields, percentiles, scale=1000)
+    # Conductivities are constant per profile and fetched separately
+    tissues = ", ".join([f"{t} AS k_{t}" for t in TISSUE_COLUMNS])
+    profiles = conn.execute(
+        f"SELECT (id + 1) % 21 AS k_id, {tissues} FROM conductivity_profiles"
+    ).fetchdf()
+    return df.merge(profiles, on="k_id", how="left")
+
+
+def extract_experiments_statistics(
+    db_path: Union[str, Path],
+    experiments: Iterable[ExperimentSpec],
+    output_dir: Union[str, Path] = ".",
+    fields: Sequence[str] = STATISTICS_FIELDS,
+    percentiles: Sequence[float] = STATISTICS_PERCENTILES,
+    n_bins: int = 1024,
+    batch_size: int = 1000000,
+    threads: int = 8,
+    memory_limit: str = "8GB",
+) -> List[Path]:
+    experiments = [tuple(e) for e in experiments]
+    conn = connect(db_path, threads, memory_limit)
+    df = stream_experiments_statistics(
+        conn, experiments, fields, percentiles, n_bins, batch_size
+    )
+    # Fan the results out into one CSV file per experiment
+    columns = [
+        *EXPERIMENT_COLUMNS[: EXPERIMENT_COLUMNS.index("v")],
+        *get_statistics_columns(fields, percentiles),
+        "n",
+    ]
+    paths = []
+    for roi, anode, cathode in experiments:
+        anodes = [f"{anode}{s}" for s in ANODE_SUFFIXES]
+        mask = (
+            (df["roi"] == roi) & (df["cathode"] == cathode) & df["anode"].isin(anodes)
+        )
+        path = Path(output_dir) / f"roi-{roi}_anode-{anode}_cathode-{cathode}_stats.csv"
+        format_experiment_results(df[mask], anode, columns).to_csv(
+            path, sep=";", index=False
+        )
+        paths.append(path)
+    return paths
@@ -0,0 +1,127 @@
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import EXPERIMENTS, Experiment
+from .store import GEOMETRY_COLUMNS, LOADERS
+
+VOIS = ["e", "e_r"]
+REGRESSION_COLUMNS = ["coef", "std_err", "t", "p_value", "r2", "n"]
+
+
+def get_subject_data(
+    experiment: Experiment,
+    geometry: pd.DataFrame,
+    vois: Sequence[str] = VOIS,
+    variant: str = "fem",
+    use_cache: Optional[bool] = None,
+) -> pd.DataFrame:
+    # Geometry is defined per subject, the VOIs are averaged over the conductivity
+    # profiles and placements of each subject so that only these means are kept
+    if variant not in LOADERS:
+        raise ValueError(
+            f"Unknown variant '{variant}', expected one of {tuple(LOADERS)}."
+        )
+    data = LOADERS[variant](experiment, use_cache, False)
+    sub = np.asarray(data["sub"], dtype=np.int64)
+    means = data[list(vois)].groupby(sub).mean()
+    return means.join(geometry, how="inner")
+
+
+def get_geometry(
+    experiments: Iterable[Experiment], use_cache: Optional[bool] = None
+) -> Dict[str, pd.DataFrame]:
+    geometry = {}
+    for experiment in experiments:
+        roi = str(experiment.roi)
+        if roi not in geometry:
+            df = experiment.roi.get_data(use_cache)
+            df.index = np.asarray(df["sub"], dtype=np.int64)
+            geometry[roi] = df[GEOMETRY_COLUMNS]
+    return geometry
+
+
+def get_design(
+    data: Sequence[pd.DataFrame],
+    vois: Sequence[str],
+    predictors: Sequence[str],
+    standardize: bool = True,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (n_groups, n_max, n_terms) and (n_groups, n_max, n_vois) stacked with zero rows
+    # as padding, which do not contribute to the normal equations
+    n = np.array([len(df) for df in data])
+    x = np.zeros((len(data), n.max(initial=0), len(predictors) + 1))
+    y = np.zeros((len(data), n.max(initial=0), len(vois)))
+    for i, df in enumerate(data):
+        values = df[list(predictors)].values.astype(np.float64)
+        if standardize:
+            # Effects per standard deviation of the predictors, comparable across
+            # the predictors and the ROIs
+            values = (values - values.mean(axis=0)) / values.std(axis=0, ddof=1)
+        x[i, : n[i], 0] = 1
+        x[i, : n[i], 1:] = values
+        y[i, : n[i]] = df[list(vois)].values
+    return x, y, n
+
+
+def fit_ols(x: np.ndarray, y: np.ndarray, n: np.ndarray) -> Dict[str, np.ndarray]:
+    # Ordinary least squares of all the groups and VOIs in a single batched solve
+    from scipy.stats import t as student
+
+    xtx = np.einsum("gni,gnj->gij", x, x)
+    xty = np.einsum("gni,gnv->giv", x, y)
+    coef = np.linalg.solve(xtx, xty)
+    residuals = y - x @ coef
+    valid = (np.arange(x.shape[1]) < n[:, np.newaxis])[:, :, np.newaxis]
+    dof = (n - x.shape[2])[:, np.newaxis]
+    sse = (residuals**2).sum(axis=1)
+    y_mean = y.sum(axis=1, keepdims=True) / n[:, np.newaxis, np.newaxis]
+    sst = (((y - y_mean) * valid) ** 2).sum(axis=1)
+    # (n_groups, n_terms, n_vois)
+    xtx_inv = np.linalg.inv(xtx).diagonal(axis1=1, axis2=2)
+    std_err = np.sqrt(xtx_inv[:, :, np.newaxis] * (sse / dof)[:, np.newaxis])
+    t = coef / std_err
+    return dict(
+        coef=coef,
+        std_err=std_err,
+        t=t,
+        p_value=2 * student.sf(np.abs(t), dof[:, np.newaxis]),
+        r2=np.broadcast_to((1 - sse / sst)[:, np.newaxis], coef.shape),
+        n=np.broadcast_to(n[:, np.newaxis, np.newaxis], coef.shape),
+    )
+
+
+def fit_geometry_regressions(
+    experiments: Iterable[Experiment] = EXPERIMENTS,
+    vois: Sequence[str] = VOIS,
+    predictors: Sequence[str] = GEOMETRY_COLUMNS,
+    variant: str = "fem",
+    standardize: bool = True,
+    use_cache: Optional[bool] = None,
+) -> pd.DataFrame:
+    # Regressions of the VOIs on the geometry of the ROIs of the subjects, one per
+    # experiment and VOI, each experiment being loaded and reduced in turn
+    experiments = list(experiments)
+    geometry = get_geometry(experiments, use_cache)
+    data = [
+        get_subject_data(e, geometry[str(e.roi)], vois, variant, use_cache)
+        for e in experiments
+    ]
+    if any(len(df) <= len(predictors) + 1 for df in data):
+        raise ValueError("Every experiment must have more subjects than terms.")
+    results = fit_ols(*get_design(data, vois, predictors, standardize))
+    # (roi, montage, voi, term) as the other tables of the package
+    index = pd.MultiIndex.from_tuples(
+        [
+            (str(e.roi), e.montage, voi, term)
+            for e in experiments
+            for voi in vois
+            for term in ["intercept", *predictors]
+        ],
+        names=["roi", "montage", "voi", "term"],
+    )
+    return pd.DataFrame(
+        {name: results[name].transpose(0, 2, 1).ravel() for name in REGRESSION_COLUMNS},
+        index=index,
+    ).astype({"n": np.int64})
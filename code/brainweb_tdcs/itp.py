@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.typing import ArrayLike
+
+from . import EXPERIMENTS, Experiment
+
+SHAPE_RATIOS = (10 / 8, 10 / 5, 10 / 2)
+SUMMARY_COLUMNS = ["mean", "std", "min", "25%", "50%", "75%", "max"]
+
+
+def get_depolarization_factors(gamma: ArrayLike) -> Tuple[np.ndarray, np.ndarray]:
+    # (l_z, l_x) of prolate spheroids of shape ratios γ = r_1 / r_2
+    gamma = np.asarray(gamma, dtype=np.float64)
+    if (gamma < 1).any():
+        raise ValueError("Shape ratios must be greater than or equal to 1.")
+    # Spheres are depolarized equally along all the axes
+    sphere = gamma == 1
+    λ = np.sqrt(1 - (1 / np.where(sphere, 2, gamma)) ** 2)
+    l_z = ((1 - λ**2) / (2 * λ**3)) * (np.log((1 + λ) / (1 - λ)) - 2 * λ)
+    l_z = np.where(sphere, 1 / 3, l_z)
+    return l_z, (1 - l_z) / 2
+
+
+def get_sphere_itp(e: ArrayLike) -> np.ndarray:
+    # Maximum induced transmembrane potential to radius ratio (Schwan, 1957)
+    return 3 / 2 * np.asarray(e)
+
+
+def get_spheroid_itp(
+    e_r: ArrayLike,
+    e_t: ArrayLike,
+    gamma: ArrayLike = SHAPE_RATIOS,
+    tilts: Optional[ArrayLike] = None,
+) -> np.ndarray:
+    # (n_samples, n_gammas, n_tilts): maximum induced transmembrane potential to
+    # radius ratio (Valic et al., 2003) of cells whose main axis is tilted from the
+    # normal of the cortical surface towards the tangential field
+    e_r = np.asarray(e_r, dtype=np.float64).reshape(-1, 1, 1)
+    e_t = np.asarray(e_t, dtype=np.float64).reshape(-1, 1, 1)
+    gamma = np.atleast_1d(np.asarray(gamma, dtype=np.float64))
+    tilts = np.zeros(1) if tilts is None else np.atleast_1d(tilts)
+    l_z, l_x = get_depolarization_factors(gamma)
+    cos, sin = np.cos(tilts), np.sin(tilts)
+    e_z = np.abs(e_r * cos + e_t * sin)
+    e_x = np.abs(e_t * cos - e_r * sin)
+    # Value at φ = atan(η e_x / e_z), where the derivative along the membrane is zero
+    return np.hypot(
+        e_x / (gamma * (1 - l_x))[:, np.newaxis],
+        e_z / (1 - l_z)[:, np.newaxis],
+    )
+
+
+def summarize_itp(values: np.ndarray) -> np.ndarray:
+    # (n_gammas, n_statistics) over the samples and tilts of each shape ratio
+    values = values.transpose(1, 0, 2).reshape(values.shape[1], -1)
+    q1, median, q3 = np.percentile(values, [25, 50, 75], axis=1)
+    return np.stack(
+        (
+            values.mean(axis=1),
+            values.std(axis=1, ddof=1),
+            values.min(axis=1),
+            q1,
+            median,
+            q3,
+            values.max(axis=1),
+        ),
+        axis=1,
+    )
+
+
+def _summarize_chunk(
+    e_r: np.ndarray, e_t: np.ndarray, gamma: np.ndarray, tilts: Optional[np.ndarray]
+) -> np.ndarray:
+    return summarize_itp(get_spheroid_itp(e_r, e_t, gamma, tilts))
+
+
+def get_chunks(
+    n_samples: int, gamma: np.ndarray, n_tilts: int, chunk_size: int
+) -> List[np.ndarray]:
+    # Shape ratios evaluated together without exceeding chunk_size values
+    per_chunk = max(1, chunk_size // max(1, n_samples * n_tilts))
+    return [gamma[i : i + per_chunk] for i in range(0, len(gamma), per_chunk)]
+
+
+def compute_itp(
+    experiments: Iterable[Experiment] = EXPERIMENTS,
+    gamma: ArrayLike = SHAPE_RATIOS,
+    tilts: Optional[ArrayLike] = None,
+    use_gpr: bool = False,
+    chunk_size: int = 2**22,
+    n_threads: int = 1,
+) -> pd.DataFrame:
+    gamma = np.atleast_1d(np.asarray(gamma, dtype=np.float64))
+    n_tilts = 1 if tilts is None else np.size(tilts)
+    rows = []
+    tasks = []
+    for experiment in experiments:
+        data = experiment.get_gpr_data() if use_gpr else experiment.get_data()
+        e, e_r, e_t = data[["e", "e_r", "e_t"]].values.T
+        sphere = get_sphere_itp(e)[:, np.newaxis, np.newaxis]
+        key = (str(experiment.roi), experiment.montage)
+        rows.append((*key, "sphere", 1.0))
+        tasks.append(partial(summarize_itp, sphere))
+        for chunk in get_chunks(len(data), gamma, n_tilts, chunk_size):
+            rows.extend((*key, "spheroid", g) for g in chunk)
+            tasks.append(partial(_summarize_chunk, e_r, e_t, chunk, tilts))
+    # NumPy releases the GIL on the large arrays of the chunks
+    if n_threads == 1:
+        results = [task() for task in tasks]
+    else:
+        with ThreadPoolExecutor(n_threads) as executor:
+            results = [f.result() for f in [executor.submit(t) for t in tasks]]
+    index = pd.MultiIndex.from_tuples(rows, names=["roi", "montage", "cell", "gamma"])
+    return pd.DataFrame(np.concatenate(results), index=index, columns=SUMMARY_COLUMNS)
@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+from typing import Iterable, Sequence
+
+import chaospy as cp
+import numpy as np
+import pandas as pd
+
+from . import EXPERIMENTS, TISSUES, Experiment
+from .surrogate import VOIS
+
+DISTRIBUTIONS = {
+    "uniform": lambda tissue: tissue.k_uni,
+    "truncnorm": lambda tissue: tissue.k,
+}
+
+
+def get_joint_distribution(kind: str = "uniform") -> cp.Distribution:
+    return cp.J(*[DISTRIBUTIONS[kind](tissue) for tissue in TISSUES.values()])
+
+
+@dataclass
+class PolynomialChaosExpansion:
+
+    expansion: cp.ndpoly
+    coefficients: np.ndarray
+    multi_indices: np.ndarray
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self.coefficients[0]
+
+    @property
+    def variance(self) -> np.ndarray:
+        return (self.coefficients[1:] ** 2).sum(axis=0)
+
+    def predict(self, kappas: np.ndarray) -> np.ndarray:
+        return self.expansion(*np.atleast_2d(kappas).T).T @ self.coefficients
+
+    def sobol_indices(self) -> np.ndarray:
+        # (2, n_tissues, n_outputs): first order and total indices from the
+        # squared coefficients of the orthonormal basis
+        c2 = self.coefficients**2
+        active = self.multi_indices > 0
+        only = active & (active.sum(axis=1, keepdims=True) == 1)
+        variance = np.where(self.variance > 0, self.variance, np.nan)
+        return np.stack((only.T @ c2, active.T @ c2)) / variance
+
+
+def fit_pce(
+    kappas: np.ndarray,
+    evals: np.ndarray,
+    distribution: cp.Distribution,
+    order: int = 3,
+) -> PolynomialChaosExpansion:
+    expansion = cp.generate_expansion(order, distribution, normed=True)
+    multi_indices = np.array([p.exponents.max(axis=0) for p in expansion])
+    # One least squares problem for all the outputs
+    basis = expansion(*kappas.T).T
+    coefficients, *_ = np.linalg.lstsq(
+        basis, evals.reshape(len(kappas), -1), rcond=None
+    )
+    return PolynomialChaosExpansion(expansion, coefficients, multi_indices)
+
+
+def compute_sobol_indices(
+    experiment: Experiment,
+    vois: Sequence[str] = VOIS,
+    distribution: str = "uniform",
+    order: int = 3,
+    n_samples: int = 1000,
+    seed: int = 1234,
+) -> pd.DataFrame:
+    joint = get_joint_distribution(distribution)
+    surrogate = experiment.get_surrogate(vois=list(vois))
+    # The expansion is regressed on cheap surrogate evaluations
+    kappas = joint.sample(n_samples, rule="halton", seed=seed).T
+    evals = surrogate.predict(kappas)
+    pce = fit_pce(kappas, evals, joint, order)
+    indices = pce.sobol_indices().reshape(2, len(TISSUES), *surrogate.shape)
+    # Tidy table indexed like the outputs of the surrogate
+    index = pd.MultiIndex.from_product(
+        [list(TISSUES), surrogate.vois, surrogate.placements, surrogate.subs],
+        names=["tissue", "voi", "p", "sub"],
+    )
+    df = pd.DataFrame(
+        {"first_order": indices[0].ravel(), "total": indices[1].ravel()},
+        index=index,
+    ).reset_index()
+    df.insert(0, "montage", experiment.montage)
+    df.insert(0, "roi", str(experiment.roi))
+    return df
+
+
+def rank_tissues(
+    experiments: Iterable[Experiment] = EXPERIMENTS,
+    vois: Sequence[str] = VOIS,
+    distribution: str = "uniform",
+    order: int = 3,
+    by: Sequence[str] = ("roi", "montage", "voi"),
+) -> pd.DataFrame:
+    df = pd.concat(
+        [compute_sobol_indices(e, vois, distribution, order) for e in experiments],
+        ignore_index=True,
+    )
+    ranks = df.groupby([*by, "tissue"])[["first_order", "total"]].mean()
+    ranks["rank"] = ranks.groupby(level=list(by))["total"].rank(ascending=False)
+    return ranks.sort_values([*by, "rank"])
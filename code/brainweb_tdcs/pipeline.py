@@ -0,0 +1,356 @@
+import argparse
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from . import EXPERIMENTS, ROIS, Experiment
+from .cache import get_cache_dir, hash_file
+
+STATE_VERSION = 1
+PACKAGE_DIR = Path(__file__).parent
+STAGES = ["extract_experiments", "extract_rois", "generate_gpr", "render_reports"]
+
+
+@dataclass
+class Task:
+
+    name: str
+    outputs: List[Path]
+    inputs: List[Path] = field(default_factory=list)
+    parameters: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Stage:
+
+    name: str
+    tasks: List[Task]
+    # Called with the stale tasks and a callback marking each task as done
+    run: Callable[[List[Task], Callable[[Task], None]], None]
+    # Source files of the package defining the code version of the stage
+    modules: Sequence[str] = ()
+    # Stale tasks run together, e.g. in a single scan of the database
+    batch: bool = False
+
+
+def get_file_stamp(path: Union[str, Path]) -> Dict[str, Any]:
+    # Hashing the content of the database is as costly as extracting it
+    stat = Path(path).stat()
+    return {
+        "path": str(Path(path).resolve()),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+
+
+def get_code_version(modules: Sequence[str]) -> str:
+    paths = PACKAGE_DIR.glob("*.py") if "*" in modules else []
+    paths = sorted({*paths, *(PACKAGE_DIR / f"{m}.py" for m in modules if m != "*")})
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def get_fingerprint(task: Task, code_version: str) -> str:
+    inputs = {str(path): hash_file(path) for path in task.inputs}
+    content = dict(code=code_version, inputs=inputs, parameters=task.parameters)
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def get_state_path() -> Path:
+    return get_cache_dir("pipeline") / "state.json"
+
+
+def load_state(path: Path) -> Dict[str, str]:
+    try:
+        state = json.loads(Path(path).read_text())
+    except FileNotFoundError:
+        return {}
+    # Fingerprints of other versions are not comparable
+    return state["tasks"] if state.get("version") == STATE_VERSION else {}
+
+
+def save_state(path: Path, tasks: Dict[str, str]) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    state = {"version": STATE_VERSION, "tasks": tasks}
+    tmp_path.write_text(json.dumps(state, indent=1, sort_keys=True))
+    tmp_path.replace(path)
+
+
+def _get_experiment_name(experiment: Experiment) -> str:
+    return Path(experiment.data_file_name).stem
+
+
+def get_extract_experiments_stage(
+    db_path: Path, experiments: Sequence[Experiment], **kwargs
+) -> Stage:
+    from .extraction import extract_experiments_results
+
+    def run(tasks: List[Task], done: Callable[[Task], None]) -> None:
+        output_dir = tasks[0].outputs[0].parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        specs = [t.parameters["experiment"] for t in tasks]
+        extract_experiments_results(db_path, specs, output_dir, **kwargs)
+
+    db = get_file_stamp(db_path)
+    tasks = [
+        Task(
+            _get_experiment_name(e),
+            [e.data_path],
+            parameters={"db": db, "experiment": [str(e.roi), e.anode, e.cathode]},
+        )
+        for e in experiments
+    ]
+    return Stage("extract_experiments", tasks, run, ["extraction"], batch=True)
+
+
+def get_extract_rois_stage(
+    db_path: Path, experiments: Sequence[Experiment], **kwargs
+) -> Stage:
+    from .extraction import extract_rois_results
+
+    def run(tasks: List[Task], done: Callable[[Task], None]) -> None:
+        output_dir = tasks[0].outputs[0].parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        rois = [t.parameters["roi"] for t in tasks]
+        extract_rois_results(db_path, rois, output_dir, **kwargs)
+
+    db = get_file_stamp(db_path)
+    rois = [r for r in ROIS if any(e.roi == r for e in experiments)]
+    tasks = [
+        Task(f"roi-{r}", [r.data_path], parameters={"db": db, "roi": str(r)})
+        for r in rois
+    ]
+    return Stage("extract_rois", tasks, run, ["extraction"], batch=True)
+
+
+def get_generate_gpr_stage(
+    experiments: Sequence[Experiment],
+    random_seed: int = 1234,
+    n_workers: Optional[int] = None,
+) -> Stage:
+    from .surrogate import VOIS, generate_gpr_files
+
+    def run(tasks: List[Task], done: Callable[[Task], None]) -> None:
+        # Stale experiments fitted in parallel, next to their data files, each one
+        # being recorded as soon as it is generated
+        by_input = {t.inputs[0]: t for t in tasks}
+        generate_gpr_files(
+            list(by_input),
+            None,
+            VOIS,
+            random_seed=random_seed,
+            n_workers=n_workers,
+            callback=lambda path, _: done(by_input[path]),
+        )
+
+    parameters = {"vois": VOIS, "random_seed": random_seed}
+    tasks = [
+        Task(
+            _get_experiment_name(e), [e.gpr_data_path], [e.data_path], dict(parameters)
+        )
+        for e in experiments
+    ]
+    return Stage(
+        "generate_gpr",
+        tasks,
+        run,
+        ["surrogate", "tissues", "experiments"],
+        batch=True,
+    )
+
+
+def get_render_reports_stage(
+    experiments: Sequence[Experiment],
+    notebooks_dir: Path,
+    output_dir: Path,
+    notebooks: Optional[Sequence[str]] = None,
+) -> Stage:
+    from .report import get_reports, render_reports
+
+    reports = {}
+
+    def run(tasks: List[Task], done: Callable[[Task], None]) -> None:
+        by_name = {t.name: t for t in tasks}
+        render_reports(
+            [reports[t.name] for t in tasks],
+            notebooks_dir,
+            output_dir,
+            callback=lambda report, _: done(by_name[report.name]),
+        )
+
+    tasks = []
+    for report in get_reports():
+        if notebooks and report.notebook not in notebooks:
+            continue
+        if "experiment_id" in report.parameters:
+            used = [EXPERIMENTS[report.parameters["experiment_id"]]]
+        else:
+            roi = ROIS[report.parameters["roi_id"]]
+            used = [e for e in EXPERIMENTS if e.roi == roi]
+        if not all(e in experiments for e in used):
+            continue
+        # Reports read both the original and the generated data
+        inputs = [notebooks_dir / f"{report.notebook}.ipynb"]
+        inputs += [p for e in used for p in (e.data_path, e.gpr_data_path)]
+        output = output_dir / f"{report.name}.html"
+        parameters = {"notebook": report.notebook, **report.parameters}
+        reports[report.name] = report
+        tasks.append(Task(report.name, [output], inputs, parameters))
+    return Stage("render_reports", tasks, run, ["*"], batch=True)
+
+
+def get_stages(
+    db_path: Optional[Path] = None,
+    notebooks_dir: Path = Path("notebooks"),
+    output_dir: Path = Path("results/html"),
+    experiments: Sequence[Experiment] = EXPERIMENTS,
+    stages: Sequence[str] = STAGES,
+    notebooks: Optional[Sequence[str]] = None,
+    threads: int = 8,
+    memory_limit: str = "8GB",
+    n_workers: Optional[int] = None,
+) -> List[Stage]:
+    # Task graph derived from the experiments, in the order of the dependencies
+    for name in stages:
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}', expected one of {STAGES}.")
+    if db_path is None and {"extract_experiments", "extract_rois"} & set(stages):
+        raise ValueError("The database is required to extract the results.")
+    kwargs = dict(threads=threads, memory_limit=memory_limit)
+    pipeline = []
+    if "extract_experiments" in stages:
+        pipeline.append(get_extract_experiments_stage(db_path, experiments, **kwargs))
+    if "extract_rois" in stages:
+        pipeline.append(get_extract_rois_stage(db_path, experiments, **kwargs))
+    if "generate_gpr" in stages:
+        pipeline.append(get_generate_gpr_stage(experiments, n_workers=n_workers))
+    if "render_reports" in stages:
+        pipeline.append(
+            get_render_reports_stage(
+                experiments, Path(notebooks_dir), Path(output_dir), notebooks
+            )
+        )
+    return pipeline
+
+
+def run_pipeline(
+    stages: Sequence[Stage],
+    state_path: Optional[Path] = None,
+    force: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, bool]:
+    # Tasks are skipped when the fingerprint of their inputs, parameters and code is
+    # unchanged and their outputs exist
+    state_path = get_state_path() if state_path is None else Path(state_path)
+    state = load_state(state_path)
+    planned = set()
+    status = {}
+    for stage in stages:
+        code_version = get_code_version(stage.modules)
+        stale = []
+        for task in stage.tasks:
+            key = f"{stage.name}/{task.name}"
+            # Inputs of a dry run may not be produced yet
+            if dry_run and (
+                planned.intersection(task.inputs)
+                or not all(p.exists() for p in task.inputs)
+            ):
+                fingerprint = None
+            else:
+                fingerprint = get_fingerprint(task, code_version)
+            is_stale = (
+                force
+                or fingerprint is None
+                or state.get(key) != fingerprint
+                or not all(p.exists() for p in task.outputs)
+            )
+            status[key] = is_stale
+            if is_stale:
+                stale.append((key, task, fingerprint))
+        if dry_run:
+            planned.update(p for _, task, _ in stale for p in task.outputs)
+            continue
+        batches = [stale] if stage.batch and stale else [[s] for s in stale]
+        for batch in batches:
+            fingerprints = {task.name: (key, f) for key, task, f in batch}
+
+            def done(task: Task) -> None:
+                # Progress is kept if a later task fails
+                key, fingerprint = fingerprints[task.name]
+                state[key] = fingerprint
+                save_state(state_path, state)
+
+            stage.run([task for _, task, _ in batch], done)
+            state.update(fingerprints.values())
+            save_state(state_path, state)
+    return status
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the stages of the pipeline whose inputs changed since the "
+        "last run."
+    )
+    parser.add_argument("--db", type=Path, help="path of brainweb-tdcs.db")
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, metavar="STAGE"
+    )
+    parser.add_argument(
+        "--rois",
+        nargs="+",
+        choices=[str(r) for r in ROIS],
+        help="ROIs of the experiments (all by default)",
+    )
+    parser.add_argument(
+        "--notebooks",
+        nargs="+",
+        help="names of the notebooks to render (all by default)",
+    )
+    parser.add_argument("--notebooks-dir", type=Path, default=Path("notebooks"))
+    parser.add_argument("--output-dir", type=Path, default=Path("results/html"))
+    parser.add_argument("--state", type=Path, help="path of the state file")
+    parser.add_argument("--force", action="store_true", help="run all the tasks")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only list the tasks to run"
+    )
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--memory-limit", default="8GB")
+    parser.add_argument(
+        "--n-workers", type=int, help="processes generating the GPR results"
+    )
+    args = parser.parse_args(argv)
+    extract = [s for s in args.stages if s.startswith("extract_")]
+    if extract and args.db is None:
+        parser.error(f"--db is required by the {', '.join(extract)} stages")
+    # Fitted models are reused across the reports and between runs, the data are
+    # loaded as by the notebooks run with papermill
+    os.environ.setdefault("BRAINWEB_TDCS_USE_TRACE_CACHE", "1")
+    experiments = [e for e in EXPERIMENTS if not args.rois or str(e.roi) in args.rois]
+    stages = get_stages(
+        args.db,
+        args.notebooks_dir,
+        args.output_dir,
+        experiments,
+        args.stages,
+        args.notebooks,
+        args.threads,
+        args.memory_limit,
+        args.n_workers,
+    )
+    status = run_pipeline(stages, args.state, args.force, args.dry_run)
+    for key, is_stale in status.items():
+        print(f"{'run' if is_stale else 'skip'} {key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,31 @@
-from typing import Iterable, Optional, Union, List, Tuple
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Optional,
+    Sequence,
+    Union,
+    List,
+    Tuple,
+)
 
-import arviz as az
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from IPython.display import HTML, display
+from numpy.typing import ArrayLike
 
 from . import RegionOfInterest, Experiment
+from .posterior import get_posterior_density, get_rope_overlap
+from .profiling import profiled
 
+if TYPE_CHECKING:
+    import arviz as az
 
-def display_side_by_side(dfs: Iterable[pd.DataFrame], captions: Iterable[str]) -> None:
+
+def get_side_by_side_html(dfs: Iterable[pd.DataFrame], captions: Iterable[str]) -> str:
     # https://stackoverflow.com/a/57832026
     output = ""
     for caption, df in zip(captions, dfs):
@@ -20,7 +36,13 @@ def display_side_by_side(dfs: Iterable[pd.DataFrame], captions: Iterable[str]) -
             ._repr_html_()
         )
         output += "\xa0\xa0\xa0"
-    display(HTML(output))
+    return output
+
+
+def display_side_by_side(dfs: Iterable[pd.DataFrame], captions: Iterable[str]) -> None:
+    from IPython.display import HTML, display
+
+    display(HTML(get_side_by_side_html(dfs, captions)))
 
 
 def plot_density(
@@ -42,9 +64,139 @@ def plot_density(
     ax.set_title(title)
 
 
-def plot_violins(ax: plt.Axes, experiment: Union[Experiment, List[Experiment]], data) -> None:
+@dataclass
+class ViolinStatistics:
+
+    levels: np.ndarray
+    mean: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    q1: np.ndarray
+    median: np.ndarray
+    q3: np.ndarray
+    coords: np.ndarray
+    vals: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def to_vpstats(self) -> List[Dict[str, Union[float, np.ndarray]]]:
+        # Format expected by Axes.violin
+        return [
+            {
+                "coords": self.coords[i],
+                "vals": self.vals[i],
+                "mean": self.mean[i],
+                "median": self.median[i],
+                "min": self.min[i],
+                "max": self.max[i],
+            }
+            for i in range(len(self))
+        ]
+
+
+@profiled("plot.violin_statistics", rows="values")
+def get_violin_statistics(
+    values: ArrayLike,
+    groups: ArrayLike,
+    levels: Optional[Sequence] = None,
+    n_points: int = 100,
+    n_bins: int = 1024,
+    chunk_size: int = 256,
+) -> ViolinStatistics:
+    values = np.asarray(values, dtype=np.float64)
+    if levels is None:
+        codes, levels = pd.factorize(groups)
+    else:
+        codes = pd.Index(levels).get_indexer(groups)
+    levels = np.asarray(levels)
+    mask = codes >= 0
+    values, codes = values[mask], codes[mask]
+    # Sort once by group then value, each group being a contiguous sorted run
+    order = np.lexsort((values, codes))
+    values, codes = values[order], codes[order]
+    counts = np.bincount(codes, minlength=len(levels))
+    if (counts == 0).any():
+        raise ValueError("Every group must contain at least one value.")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    def quantile(q: float) -> np.ndarray:
+        # Linear interpolation, as np.quantile
+        position = starts + q * (counts - 1)
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, starts + counts - 1)
+        return values[lower] + (position - lower) * (values[upper] - values[lower])
+
+    mins, maxs = values[starts], values[starts + counts - 1]
+    means = np.bincount(codes, values) / counts
+    # Gaussian KDE with Scott's bandwidth over [min, max], as Axes.violinplot
+    variances = np.bincount(codes, (values - means[codes]) ** 2) / np.maximum(
+        counts - 1, 1
+    )
+    bandwidths = np.sqrt(variances) * counts ** (-1 / 5)
+    bandwidths = np.where(bandwidths > 0, bandwidths, 1)
+    ranges = maxs - mins
+    # Linear binning of every group on its own grid
+    t = np.divide(
+        values - mins[codes],
+        ranges[codes],
+        out=np.zeros_like(values),
+        where=ranges[codes] > 0,
+    ) * (n_bins - 1)
+    lower = np.minimum(np.floor(t).astype(int), n_bins - 2)
+    weights = t - lower
+    binned = np.bincount(
+        codes * n_bins + lower, 1 - weights, minlength=len(levels) * n_bins
+    ) + np.bincount(codes * n_bins + lower + 1, weights, minlength=len(levels) * n_bins)
+    binned = binned.reshape(len(levels), n_bins)
+    # Convolution with the gaussian kernel of each group through FFTs, on the bins
+    offsets = np.arange(1 - n_bins, n_bins) / (n_bins - 1)
+    scales = ranges / bandwidths
+    n_fft = 3 * n_bins
+    smoothed = np.empty((len(levels), n_bins))
+    for start in range(0, len(levels), chunk_size):
+        stop = start + chunk_size
+        kernels = np.exp(-0.5 * (offsets * scales[start:stop, np.newaxis]) ** 2)
+        smoothed[start:stop] = np.fft.irfft(
+            np.fft.rfft(binned[start:stop], n_fft) * np.fft.rfft(kernels, n_fft),
+            n_fft,
+        )[:, n_bins - 1 : 2 * n_bins - 1]
+    # Linear interpolation on the output points
+    t = np.linspace(0, n_bins - 1, n_points)
+    lower = np.minimum(np.floor(t).astype(int), n_bins - 2)
+    weights = t - lower
+    vals = np.clip(
+        smoothed[:, lower] * (1 - weights) + smoothed[:, lower + 1] * weights, 0, None
+    )
+    vals /= (counts * bandwidths * np.sqrt(2 * np.pi))[:, np.newaxis]
+    coords = mins[:, np.newaxis] + ranges[:, np.newaxis] * np.linspace(0, 1, n_points)
+    return ViolinStatistics(
+        levels,
+        means,
+        mins,
+        maxs,
+        quantile(0.25),
+        quantile(0.5),
+        quantile(0.75),
+        coords,
+        vals,
+    )
+
+
+def plot_violins(
+    ax: plt.Axes,
+    experiment: Union[Experiment, List[Experiment]],
+    data: Union[ViolinStatistics, List[ArrayLike]],
+) -> None:
+    if not isinstance(data, ViolinStatistics):
+        data = get_violin_statistics(
+            np.concatenate([np.asarray(d) for d in data]),
+            np.repeat(np.arange(len(data)), [len(d) for d in data]),
+        )
     # Plot violins
-    violins = ax.violinplot(data, vert=True, showmeans=False, showextrema=False)
+    violins = ax.violin(
+        data.to_vpstats(), vert=True, showmeans=False, showextrema=False
+    )
     for i, violin in enumerate(violins["bodies"]):
         e = experiment if isinstance(experiment, Experiment) else experiment[i]
         violin.set_facecolor(e.roi.color)
@@ -55,16 +207,14 @@ def plot_violins(ax: plt.Axes, experiment: Union[Experiment, List[Experiment]],
             violin.set_edgecolor(e.roi.hatch_color)
     # Plot extrema
     x = np.arange(1, len(data) + 1)
-    ax.vlines(x, np.min(data, axis=1), np.max(data, axis=1), colors="k", lw=1)
+    ax.vlines(x, data.min, data.max, colors="k", lw=1)
     # Plot median and quantiles
-    q1 = np.quantile(data, 0.25, axis=1)
-    q3 = np.quantile(data, 0.75, axis=1)
-    ax.vlines(x, q1, q3, colors="k", lw=3)
-    means = np.mean(data, axis=1)
-    ax.plot(x, means, "ko", markerfacecolor="white")
+    ax.vlines(x, data.q1, data.q3, colors="k", lw=3)
+    ax.plot(x, data.mean, "ko", markerfacecolor="white")
     return violins
 
 
+@profiled("plot.bipolar_unipolar", rows="data")
 def plot_bipolar_unipolar(
     ax: plt.Axes,
     voi: str,
@@ -74,9 +224,9 @@ def plot_bipolar_unipolar(
     title: str,
 ) -> None:
     # Get data for each montage type
-    data_per_montage = [
-        data[voi][data["montage"] == m] for m in ("bipolar", "unipolar")
-    ]
+    data_per_montage = get_violin_statistics(
+        data[voi], data["montage"], ["bipolar", "unipolar"]
+    )
     # Plot violins
     violins = plot_violins(ax, experiment, data_per_montage)
     violin = violins["bodies"][1]
@@ -90,6 +240,7 @@ def plot_bipolar_unipolar(
     ax.set_title(title)
 
 
+@profiled("plot.placement", rows="data")
 def plot_placement(
     ax: plt.Axes,
     voi: str,
@@ -100,7 +251,7 @@ def plot_placement(
     title: str,
 ) -> None:
     # Get data for each montage type
-    data_per_placement = [data[voi][data[direction] == p] for p in (-1, 0, 1)]
+    data_per_placement = get_violin_statistics(data[voi], data[direction], [-1, 0, 1])
     # Plot violins
     plot_violins(ax, experiment, data_per_placement)
     # Annotate
@@ -111,6 +262,7 @@ def plot_placement(
     ax.set_title(title)
 
 
+@profiled("plot.placement_categorical", rows="data")
 def plot_placement_categorical(
     ax: plt.Axes,
     voi: str,
@@ -120,8 +272,8 @@ def plot_placement_categorical(
     title: str,
 ) -> None:
     # Get data for each montage type
-    placements = data["p"].unique()
-    data_per_placement = [data[voi][data["p"] == p] for p in placements]
+    data_per_placement = get_violin_statistics(data[voi], data["p"])
+    placements = data_per_placement.levels
     # Plot violins
     plot_violins(ax, experiment, data_per_placement)
     # Annotate
@@ -131,6 +283,7 @@ def plot_placement_categorical(
     ax.set_title(title)
 
 
+@profiled("plot.conductivity_categorical", rows="data")
 def plot_conductivity_categorical(
     ax: plt.Axes,
     voi: str,
@@ -141,8 +294,8 @@ def plot_conductivity_categorical(
     use_latex=False,
 ) -> None:
     # Get data for each montage type
-    profiles = data["k"].unique()
-    data_per_placement = [data[voi][data["k"] == k] for k in profiles]
+    data_per_placement = get_violin_statistics(data[voi], data["k"])
+    profiles = data_per_placement.levels
     # Plot violins
     plot_violins(ax, experiment, data_per_placement)
     # Annotate
@@ -155,12 +308,13 @@ def plot_conductivity_categorical(
     ax.set_title(title)
 
 
+@profiled("plot.subject", rows="data")
 def plot_subject(
     ax: plt.Axes, voi: str, experiment: Experiment, data: pd.DataFrame, y_label: str, title: str
 ) -> None:
     # Get data for each montage type
-    subjects = data["sub"].unique()
-    data_per_subject = [data[voi][data["sub"] == s] for s in subjects]
+    data_per_subject = get_violin_statistics(data[voi], data["sub"])
+    subjects = data_per_subject.levels
     # Plot violins
     plot_violins(ax, experiment, data_per_subject)
     # Annotate
@@ -170,6 +324,7 @@ def plot_subject(
     ax.set_title(title)
 
 
+@profiled("plot.posterior", labels=["param"])
 def plot_posterior(
     ax: plt.Axes,
     experiment: Experiment,
@@ -189,9 +344,8 @@ def plot_posterior(
     if rope_width > 0:
         ax.axvspan(-rope_width, rope_width, alpha=0.1, color="k")
     # Get kde
-    overall_x, overall_y = az.kde(
-        trace.posterior[param].values[:, :, category_id], bw_fct=2.5
-    )
+    density = get_posterior_density(trace, param, bw_fct=2.5)
+    overall_x, overall_y = density.x[category_id], density.y[category_id]
     # Plot credible interval
     s_min, s_max = summary[["2.5%", "97.5%"]].loc[n]
     idx = np.where(np.bitwise_and(overall_x >= s_min, overall_x <= s_max))[0]
@@ -245,8 +399,7 @@ def plot_posterior(
         va="bottom",
     )
     # Plot posterior
-    for chain in trace.posterior[param][:, :, category_id]:
-        x, y = az.kde(chain, bw_fct=2.5)
+    for x, y in zip(density.chains_x[category_id], density.chains_y[category_id]):
         ax.plot(x, y, "--", lw=0.5, color="k", alpha=0.5)
     # Display zero
     if show_zero:
@@ -261,9 +414,4 @@ def plot_posterior(
     ax.set_title(title)
     ax.legend(loc=1)
     # Compute HDI vs ROPE
-    hdi, rope = (s_min, s_max), (-rope_width, rope_width)
-    if rope[0] > hdi[1] or rope[1] < hdi[0]:
-        return 0.0, 0.0
-    inter = (max(hdi[0], rope[0]), min(hdi[1], rope[1]))
-    dinter = abs(inter[1] - inter[0])
-    return dinter / abs(hdi[1] - hdi[0]) * 100, dinter / abs(rope[1] - rope[0]) * 100
\ No newline at end of file
+    return get_rope_overlap((s_min, s_max), rope_width)
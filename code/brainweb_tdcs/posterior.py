@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import weakref
+from dataclasses import dataclass
+from itertools import product
+from typing import TYPE_CHECKING, Any, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    import arviz as az
+
+INTERVALS = ("eti", "hdi")
+_DENSITIES: Dict[int, Dict[Tuple[str, float, int], "PosteriorDensity"]] = {}
+
+
+@dataclass
+class PosteriorDensity:
+
+    x: np.ndarray
+    y: np.ndarray
+    chains_x: np.ndarray
+    chains_y: np.ndarray
+
+
+def _fixed_point(t: float, n: int, k_sq: np.ndarray, a_sq: np.ndarray) -> float:
+    # Improved Sheather-Jones fixed point equation
+    l = 7
+    f = (
+        0.5
+        * np.pi ** (2 * l)
+        * np.sum(k_sq**l * a_sq * np.exp(-k_sq * np.pi**2 * t))
+    )
+    for j in range(l - 1, 1, -1):
+        c1 = (1 + 0.5 ** (j + 0.5)) / 3
+        c2 = np.prod(np.arange(1.0, 2 * j + 1, 2)) / (np.pi / 2) ** 0.5
+        t_j = (c1 * c2 / (n * f)) ** (2 / (3 + 2 * j))
+        f = (
+            0.5
+            * np.pi ** (2 * j)
+            * np.sum(k_sq**j * a_sq * np.exp(-k_sq * np.pi**2 * t_j))
+        )
+    return t - (2 * n * np.pi**0.5 * f) ** (-0.4)
+
+
+def _isj_root(n: int, k_sq: np.ndarray, a_sq: np.ndarray) -> float:
+    from scipy.optimize import brentq
+
+    # Root searched as arviz does, as the equation may have several
+    try:
+        t, result = brentq(
+            _fixed_point, 0, 0.01, args=(n, k_sq, a_sq), full_output=True, disp=False
+        )
+    except ValueError:
+        return np.nan
+    return t if result.converged else np.nan
+
+
+def _dct(x: np.ndarray) -> np.ndarray:
+    n = x.shape[1]
+    x = np.concatenate((x[:, ::2], x[:, n - 1 - n % 2 :: -2]), axis=1)
+    w = np.r_[1, 2 * np.exp(-1j * np.arange(1, n) * np.pi / (2 * n))]
+    return np.real(w * np.fft.fft(x, axis=1))
+
+
+def kde(
+    samples: np.ndarray, bw_fct: float = 1, grid_len: int = 512
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Same estimate as az.kde for each row of samples: linear binning, experimental
+    # bandwidth and gaussian convolution with reflected boundaries
+    n_series, n = samples.shape
+    x_min = samples.min(axis=1)
+    x_range = samples.max(axis=1) - x_min
+    x_std = samples.std(axis=1)
+    bin_width = x_range / grid_len
+    bins = ((samples - x_min[:, np.newaxis]) / bin_width[:, np.newaxis]).astype(int)
+    bins = np.clip(bins, 0, grid_len - 1) + grid_len * np.arange(n_series)[:, None]
+    counts = np.bincount(bins.ravel(), minlength=n_series * grid_len)
+    counts = counts.reshape(n_series, grid_len)
+    # Mean of the Silverman and ISJ bandwidths
+    q75, q25 = np.percentile(samples, [75, 25], axis=1)
+    silverman = 0.9 * np.minimum(x_std, (q75 - q25) / 1.34) * n ** (-0.2)
+    a_k = _dct(counts / n)
+    k_sq = np.arange(1.0, grid_len - 1) ** 2
+    a_sq = a_k[:, 1 : grid_len - 1] ** 2
+    t = np.array([_isj_root(n, k_sq, a) for a in a_sq])
+    t = np.where(t > 0, t, (silverman / x_range) ** 2)
+    bw = bw_fct * 0.5 * (silverman + t**0.5 * x_range) / bin_width
+    # Truncated gaussian kernels of different lengths, aligned on a common center
+    kernel_n = np.maximum((bw * 2 * np.pi).astype(int), 1)
+    center = (kernel_n.max() - 1) // 2
+    m = np.arange(kernel_n.max()) - center + (kernel_n[:, None] - 1) // 2
+    kernels = np.where(
+        (m >= 0) & (m < kernel_n[:, None]),
+        np.exp(-0.5 * ((m - (kernel_n[:, None] - 1) / 2) / bw[:, None]) ** 2),
+        0,
+    )
+    npad = int(grid_len / 5)
+    f = counts / bin_width[:, np.newaxis] / n
+    f = np.concatenate(
+        (f[:, npad - 1 :: -1], f, f[:, grid_len - 1 : grid_len - npad - 1 : -1]),
+        axis=1,
+    )
+    n_fft = f.shape[1] + kernels.shape[1] - 1
+    pdf = np.fft.irfft(np.fft.rfft(f, n_fft) * np.fft.rfft(kernels, n_fft), n_fft)[
+        :, center + npad : center + npad + grid_len
+    ]
+    pdf /= (bw * (2 * np.pi) ** 0.5)[:, np.newaxis]
+    grid = x_min[:, np.newaxis] + bin_width[:, np.newaxis] * (np.arange(grid_len) + 0.5)
+    return grid, pdf
+
+
+def get_posterior_density(
+    trace: az.InferenceData, param: str, bw_fct: float = 2.5, grid_len: int = 512
+) -> PosteriorDensity:
+    # Densities are cached for the lifetime of the trace
+    densities = _DENSITIES.get(id(trace))
+    if densities is None:
+        densities = _DENSITIES[id(trace)] = {}
+        weakref.finalize(trace, _DENSITIES.pop, id(trace), None)
+    key = (param, bw_fct, grid_len)
+    if key not in densities:
+        values = trace.posterior[param].values
+        n_chains, n_draws = values.shape[:2]
+        values = values.reshape(n_chains, n_draws, -1)
+        n_categories = values.shape[2]
+        x, y = kde(values.reshape(-1, n_categories).T, bw_fct, grid_len)
+        chains_x, chains_y = kde(
+            values.transpose(2, 0, 1).reshape(-1, n_draws), bw_fct, grid_len
+        )
+        shape = (n_categories, n_chains, grid_len)
+        densities[key] = PosteriorDensity(
+            x, y, chains_x.reshape(shape), chains_y.reshape(shape)
+        )
+    return densities[key]
+
+
+def get_rope_overlap(
+    interval: Tuple[float, float], rope_width: float
+) -> Tuple[float, float]:
+    # Percentages of the interval in the ROPE and of the ROPE in the interval
+    rope = (-rope_width, rope_width)
+    if rope[0] > interval[1] or rope[1] < interval[0]:
+        return 0.0, 0.0
+    inter = (max(interval[0], rope[0]), min(interval[1], rope[1]))
+    dinter = abs(inter[1] - inter[0])
+    return (
+        dinter / abs(interval[1] - interval[0]) * 100,
+        dinter / abs(rope[1] - rope[0]) * 100,
+    )
+
+
+def _get_rope_overlaps(
+    low: np.ndarray, high: np.ndarray, rope_widths: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Percentages of the intervals in the ROPEs and of the ROPEs in the intervals,
+    # broadcast over the widths and the intervals
+    dinter = np.clip(
+        np.minimum(high, rope_widths) - np.maximum(low, -rope_widths), 0, None
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return dinter / (high - low) * 100, dinter / (2 * rope_widths) * 100
+
+
+def get_rope_overlaps(
+    trace: az.InferenceData,
+    param: str,
+    rope_width: float,
+    percentiles: Sequence[float] = (2.5, 97.5),
+) -> pd.DataFrame:
+    posterior = trace.posterior[param]
+    values = posterior.values.reshape(-1, int(np.prod(posterior.shape[2:])))
+    low, high = np.percentile(values, percentiles, axis=0)
+    interval_in_rope, rope_in_interval = _get_rope_overlaps(low, high, rope_width)
+    index = (
+        pd.Index(posterior[posterior.dims[2]].values, name=posterior.dims[2])
+        if posterior.ndim == 3
+        else pd.Index([param])
+    )
+    return pd.DataFrame(
+        {
+            f"{percentiles[0]}%": low,
+            f"{percentiles[1]}%": high,
+            "interval_in_rope": interval_in_rope,
+            "rope_in_interval": rope_in_interval,
+        },
+        index=index,
+    )
+
+
+def get_posterior_samples(
+    trace: az.InferenceData, var_names: Optional[Sequence[str]] = None
+) -> Tuple[np.ndarray, pd.MultiIndex]:
+    # (n_samples, n_columns) of all the categories of all the variables
+    posterior = trace.posterior
+    var_names = list(posterior.data_vars) if var_names is None else list(var_names)
+    columns, labels = [], []
+    for name in var_names:
+        variable = posterior[name]
+        columns.append(variable.values.reshape(-1, int(np.prod(variable.shape[2:]))))
+        if variable.ndim == 2:
+            labels.append((name, name))
+        else:
+            coords = product(*[variable[d].values for d in variable.dims[2:]])
+            labels += [(name, c[0] if len(c) == 1 else c) for c in coords]
+    index = pd.MultiIndex.from_tuples(labels, names=["param", "category"])
+    return np.hstack(columns), index
+
+
+def get_intervals(
+    values: np.ndarray, prob: float = 0.95, interval: str = "eti"
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Bounds of the credible intervals of the columns of (n_samples, n_columns)
+    if interval == "eti":
+        return np.percentile(values, [50 * (1 - prob), 50 * (1 + prob)], axis=0)
+    if interval == "hdi":
+        # Narrowest of the intervals containing prob of the sorted samples, as
+        # arviz.hdi
+        values = np.sort(values, axis=0)
+        n_in = int(np.floor(prob * len(values)))
+        start = (values[n_in:] - values[: len(values) - n_in]).argmin(axis=0)
+        columns = np.arange(values.shape[1])
+        return values[start, columns], values[start + n_in, columns]
+    raise ValueError(f"Unknown interval '{interval}', expected one of {INTERVALS}.")
+
+
+def get_rope_table(
+    trace: az.InferenceData,
+    rope_widths: Sequence[float],
+    var_names: Optional[Sequence[str]] = None,
+    interval: str = "eti",
+    prob: float = 0.95,
+) -> pd.DataFrame:
+    # Intervals, probability of direction and ROPE decisions of all the parameters
+    # and categories for all the widths, indexed by (rope_width, param, category)
+    values, index = get_posterior_samples(trace, var_names)
+    low, high = get_intervals(values, prob, interval)
+    p_direction = np.maximum((values > 0).mean(axis=0), (values < 0).mean(axis=0))
+    widths = np.asarray(rope_widths, dtype=np.float64).reshape(-1, 1)
+    interval_in_rope, rope_in_interval = _get_rope_overlaps(low, high, widths)
+    # Null value rejected when the interval is outside of the ROPE and accepted when
+    # it is inside (Kruschke, 2018)
+    decision = np.where(
+        (low > widths) | (high < -widths),
+        "reject",
+        np.where((low >= -widths) & (high <= widths), "accept", "undecided"),
+    )
+    n_widths = len(widths)
+    return pd.DataFrame(
+        {
+            "low": np.tile(low, n_widths),
+            "high": np.tile(high, n_widths),
+            "p_direction": np.tile(p_direction, n_widths),
+            "interval_in_rope": interval_in_rope.ravel(),
+            "rope_in_interval": rope_in_interval.ravel(),
+            "decision": decision.ravel(),
+        },
+        index=pd.MultiIndex.from_tuples(
+            [(w, *label) for w in widths.ravel() for label in index],
+            names=["rope_width", *index.names],
+        ),
+    )
+
+
+def get_rope_tables(
+    traces: Mapping[Any, az.InferenceData],
+    rope_widths: Sequence[float],
+    names: Optional[Sequence[str]] = None,
+    **kwargs,
+) -> pd.DataFrame:
+    # Tables of several experiments, e.g. keyed by (roi, montage)
+    return pd.concat(
+        {
+            key: get_rope_table(trace, rope_widths, **kwargs)
+            for key, trace in traces.items()
+        },
+        names=names,
+    )
@@ -0,0 +1,63 @@
+import argparse
+import json
+from pathlib import Path
+from typing import Optional, Sequence
+
+import pandas as pd
+
+
+def load_profiles(directory: Path) -> pd.DataFrame:
+    rows = []
+    for path in sorted(Path(directory).glob("*.json")):
+        content = json.loads(path.read_text())
+        run = dict(run=path.stem, host=content["run"]["host"])
+        for record in content["records"]:
+            labels = record.pop("labels")
+            rows.append({**run, **record, **labels})
+    return pd.DataFrame(rows)
+
+
+def aggregate_profiles(
+    records: pd.DataFrame, by: Sequence[str] = ("stage",)
+) -> pd.DataFrame:
+    df = records.groupby(list(by)).agg(
+        calls=("wall_time", "size"),
+        wall_time=("wall_time", "sum"),
+        self_time=("self_time", "sum"),
+        max_wall_time=("wall_time", "max"),
+        # Stages without rows are left missing rather than summed to zero
+        rows=("rows", lambda rows: rows.sum(min_count=1)),
+        max_rss=("max_rss", "max"),
+        rss_increase=("rss_increase", "max"),
+    )
+    df["rows_per_second"] = df["rows"] / df["wall_time"]
+    # Stages worth parallelising first
+    return df.sort_values("self_time", ascending=False)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Aggregate the profiles of the runs written to "
+        "BRAINWEB_TDCS_PROFILE_DIR."
+    )
+    parser.add_argument("profile_dir", type=Path)
+    parser.add_argument(
+        "--by", nargs="+", default=["stage"], help="columns of the aggregation"
+    )
+    parser.add_argument("--output", type=Path, help="CSV file of the aggregation")
+    parser.add_argument("--records", type=Path, help="CSV file of all the records")
+    args = parser.parse_args(argv)
+    records = load_profiles(args.profile_dir)
+    if records.empty:
+        raise ValueError(f"No profiles found in '{args.profile_dir}'.")
+    if args.records is not None:
+        records.to_csv(args.records, index=False)
+    df = aggregate_profiles(records, args.by)
+    if args.output is not None:
+        df.to_csv(args.output)
+    with pd.option_context("display.width", None, "display.max_columns", None):
+        print(df)
+
+
+if __name__ == "__main__":
+    main()
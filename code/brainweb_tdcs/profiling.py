@@ -0,0 +1,139 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import resource
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+RECORDS = []
+_STACK = []
+_RUN = {}
+
+
+@dataclass
+class Record:
+
+    stage: str
+    parent: Optional[str]
+    start: float
+    wall_time: float = 0.0
+    self_time: float = 0.0
+    # High-water mark of the process at the end of the stage, and how much the stage
+    # raised it
+    max_rss: int = 0
+    rss_increase: int = 0
+    rows: Optional[int] = None
+    labels: Dict[str, Any] = field(default_factory=dict)
+
+
+def get_profile_dir() -> Optional[Path]:
+    value = os.environ.get("BRAINWEB_TDCS_PROFILE_DIR")
+    return Path(value) if value else None
+
+
+def get_max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def count_rows(value: Any) -> Optional[int]:
+    if hasattr(value, "shape"):
+        return int(value.shape[0]) if len(value.shape) else 1
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _start_run() -> None:
+    # Worker processes forked after the first records start their own run
+    if not _RUN:
+        atexit.register(write_profile)
+    RECORDS.clear()
+    _RUN.update(argv=sys.argv, host=socket.gethostname(), pid=os.getpid())
+    _RUN["start"] = time.time()
+
+
+@contextmanager
+def profile(
+    stage: str, rows: Optional[int] = None, **labels: Any
+) -> Iterator[Optional[Record]]:
+    # Nothing is recorded unless the profile directory is set
+    if get_profile_dir() is None:
+        yield None
+        return
+    if _RUN.get("pid") != os.getpid():
+        _start_run()
+    parent = _STACK[-1][0] if _STACK else None
+    record = Record(stage, parent and parent.stage, time.time(), rows=rows)
+    record.labels.update({k: str(v) for k, v in labels.items()})
+    max_rss = get_max_rss()
+    # Wall time of the nested stages is accumulated next to the record
+    _STACK.append([record, 0.0])
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.wall_time = time.perf_counter() - start
+        record.self_time = record.wall_time - _STACK.pop()[1]
+        if _STACK:
+            _STACK[-1][1] += record.wall_time
+        record.max_rss = get_max_rss()
+        record.rss_increase = record.max_rss - max_rss
+        RECORDS.append(record)
+
+
+def profiled(
+    stage: str, rows: Optional[str] = None, labels: Sequence[str] = ()
+) -> Callable[[F], F]:
+    # Rows counted on an argument or on the returned value ("return")
+    def decorator(func: F) -> F:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if get_profile_dir() is None:
+                return func(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs).arguments
+            values = {name: arguments.get(name) for name in labels}
+            n_rows = None if rows in (None, "return") else count_rows(arguments[rows])
+            with profile(stage, n_rows, **values) as record:
+                result = func(*args, **kwargs)
+                if rows == "return":
+                    record.rows = count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def add_rows(n_rows: int) -> None:
+    # Rows counted while the innermost stage runs, e.g. streamed records
+    if _STACK:
+        record = _STACK[-1][0]
+        record.rows = (record.rows or 0) + n_rows
+
+
+def write_profile(directory: Optional[Path] = None) -> Optional[Path]:
+    directory = get_profile_dir() if directory is None else Path(directory)
+    if directory is None or not RECORDS:
+        return None
+    directory.mkdir(parents=True, exist_ok=True)
+    start = time.strftime("%Y%m%dT%H%M%S", time.localtime(_RUN["start"]))
+    path = directory / f"{start}_{_RUN['host']}_{_RUN['pid']}.json"
+    content = {"run": _RUN, "records": [asdict(r) for r in RECORDS]}
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(content, indent=1))
+    tmp_path.replace(path)
+    return path
@@ -0,0 +1,231 @@
+import argparse
+import ast
+import io
+import os
+import traceback
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import matplotlib.pyplot as plt
+import nbformat
+from IPython.core.interactiveshell import InteractiveShell
+from IPython.display import SVG, display
+from IPython.utils.capture import capture_output
+from matplotlib._pylab_helpers import Gcf
+from matplotlib.backend_bases import FigureManagerBase
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from nbconvert import HTMLExporter
+from nbformat.v4 import new_code_cell, new_output
+from traitlets.config import Config
+
+from . import EXPERIMENTS, ROIS
+from .exceptions import ReportError
+
+BACKEND = "module://brainweb_tdcs.report"
+EXPERIMENT_NOTEBOOKS = [
+    "anode_placement",
+    "conductivity_profile",
+    "induced_transmembrane_potential",
+    "subject",
+]
+ROI_NOTEBOOKS = {"bipolar_unipolar": ["MC", "dlPFC"]}
+
+# Matplotlib backend embedding the figures in the reports
+FigureCanvas = FigureCanvasAgg
+FigureManager = FigureManagerBase
+
+
+def show(*args, **kwargs) -> None:
+    for manager in Gcf.get_all_fig_managers():
+        svg = io.StringIO()
+        manager.canvas.figure.savefig(svg, format="svg", bbox_inches="tight")
+        display(SVG(svg.getvalue()))
+    plt.close("all")
+
+
+@dataclass
+class Report:
+
+    notebook: str
+    name: str
+    parameters: Dict[str, Any] = field(default_factory=dict)
+
+
+def get_reports(use_gpr: Sequence[int] = (0, 1)) -> List[Report]:
+    # Same reports as the notebook processes of the pipeline
+    reports = []
+    for gpr in use_gpr:
+        suffix = "_gpr" if gpr else ""
+        for notebook in EXPERIMENT_NOTEBOOKS:
+            for i, e in enumerate(EXPERIMENTS):
+                name = f"{notebook}_roi-{e.roi}_anode-{e.anode}_cathode-{e.cathode}"
+                parameters = {"experiment_id": i, "use_gpr": gpr}
+                reports.append(Report(notebook, f"{name}{suffix}", parameters))
+        for notebook, rois in ROI_NOTEBOOKS.items():
+            for roi in rois:
+                roi_id = [r.name for r in ROIS].index(roi)
+                parameters = {"roi_id": roi_id, "use_gpr": gpr}
+                reports.append(
+                    Report(notebook, f"{notebook}_roi-{roi}{suffix}", parameters)
+                )
+    return reports
+
+
+def get_exporter() -> HTMLExporter:
+    # Same cells and outputs removed as by the nbconvert calls of the pipeline
+    config = Config()
+    config.TagRemovePreprocessor.enabled = True
+    config.TagRemovePreprocessor.remove_cell_tags = {
+        "hide_cell",
+        "parameters",
+        "injected-parameters",
+    }
+    config.TagRemovePreprocessor.remove_input_tags = {"hide_input"}
+    config.TagRemovePreprocessor.remove_all_outputs_tags = {"hide_output"}
+    return HTMLExporter(config=config)
+
+
+def execute_cell(shell: InteractiveShell, source: str) -> List[nbformat.NotebookNode]:
+    # Magics only configure the notebook frontend
+    lines = [l for l in source.splitlines() if not l.lstrip().startswith("%")]
+    tree = ast.parse(shell.transform_cell("\n".join(lines)))
+    last = (
+        tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+    )
+    error = None
+    with capture_output() as captured:
+        try:
+            exec(compile(tree, "<cell>", "exec"), shell.user_ns)
+            if last is not None:
+                result = eval(
+                    compile(ast.Expression(last.value), "<cell>", "eval"),
+                    shell.user_ns,
+                )
+                if result is not None:
+                    display(result)
+        except Exception as e:
+            error = e
+        # Figures left open are shown at the end of the cell, as with the inline backend
+        show()
+    outputs = []
+    for name in ("stdout", "stderr"):
+        text = getattr(captured, name)
+        if text:
+            outputs.append(new_output("stream", name=name, text=text))
+    for output in captured.outputs:
+        outputs.append(
+            new_output("display_data", data=output.data, metadata=output.metadata or {})
+        )
+    # Errors are kept in the outputs, as nbconvert does with allow_errors
+    if error is not None:
+        outputs.append(
+            new_output(
+                "error",
+                ename=type(error).__name__,
+                evalue=str(error),
+                traceback=traceback.format_exception(
+                    type(error), error, error.__traceback__
+                ),
+            )
+        )
+    return outputs
+
+
+def render_report(
+    report: Report,
+    notebooks_dir: Path,
+    output_dir: Path,
+    exporter: Optional[HTMLExporter] = None,
+) -> Path:
+    exporter = get_exporter() if exporter is None else exporter
+    nb = nbformat.read(Path(notebooks_dir) / f"{report.notebook}.ipynb", as_version=4)
+    # Parameters injected after the parameters cell, as papermill does
+    cells = []
+    for cell in nb.cells:
+        cells.append(cell)
+        if "parameters" in cell.metadata.get("tags", []):
+            source = "\n".join(f"{k} = {v!r}" for k, v in report.parameters.items())
+            cells.append(
+                new_code_cell(source, metadata={"tags": ["injected-parameters"]})
+            )
+    nb.cells = cells
+    # Fresh namespace for each report while the imported modules are kept
+    shell = InteractiveShell.instance()
+    shell.reset(new_session=False)
+    errors = []
+    with plt.rc_context():
+        for cell in nb.cells:
+            if cell.cell_type == "code":
+                cell.outputs = execute_cell(shell, cell.source)
+                errors += [o for o in cell.outputs if o.output_type == "error"]
+    body, _ = exporter.from_notebook_node(nb)
+    path = Path(output_dir) / f"{report.name}.html"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(body, encoding="utf-8")
+    # The report is written with the errors for inspection
+    if errors:
+        raise ReportError(
+            f"{len(errors)} failed cells, first: {errors[0].ename}: {errors[0].evalue}"
+        )
+    return path
+
+
+def render_reports(
+    reports: Sequence[Report],
+    notebooks_dir: Path,
+    output_dir: Path,
+    callback: Optional[Callable[[Report, Path], None]] = None,
+) -> List[Path]:
+    plt.switch_backend(BACKEND)
+    exporter = get_exporter()
+    # A failing report does not prevent rendering the other ones
+    paths = []
+    failures = []
+    for report in reports:
+        try:
+            path = render_report(report, notebooks_dir, output_dir, exporter)
+        except Exception as e:
+            failures.append(f"{report.name}: {e}")
+            continue
+        paths.append(path)
+        if callback is not None:
+            callback(report, path)
+    if failures:
+        raise ReportError(
+            f"{len(failures)} of {len(reports)} reports failed:\n" + "\n".join(failures)
+        )
+    return paths
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Render the notebooks to static HTML reports in a single process."
+    )
+    parser.add_argument(
+        "notebooks", nargs="*", help="names of the notebooks to render (all by default)"
+    )
+    parser.add_argument("--notebooks-dir", type=Path, default=Path("notebooks"))
+    parser.add_argument("--output-dir", type=Path, default=Path("results/html"))
+    parser.add_argument(
+        "--use-gpr", type=int, nargs="+", choices=(0, 1), default=[0, 1]
+    )
+    args = parser.parse_args(argv)
+    # Fitted models are reused across the reports and between runs, the data are
+    # loaded as by the notebooks run with papermill
+    os.environ.setdefault("BRAINWEB_TDCS_USE_TRACE_CACHE", "1")
+    reports = [
+        r
+        for r in get_reports(args.use_gpr)
+        if not args.notebooks or r.notebook in args.notebooks
+    ]
+    try:
+        paths = render_reports(reports, args.notebooks_dir, args.output_dir)
+    except ReportError as e:
+        parser.exit(1, f"{e}\n")
+    for path in paths:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import os
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 import pandas as pd
 
 from . import MissingEnvironmentVariable
+from .cache import read_csv
 
 
 @dataclass
@@ -35,8 +37,8 @@ class RegionOfInterest:
                 "Missing 'BRAINWEB_TDCS_DATA_DIR' environment variable."
             )
 
-    def get_data(self) -> pd.DataFrame:
-        return pd.read_csv(self.data_path, sep=";")
+    def get_data(self, use_cache: Optional[bool] = None) -> pd.DataFrame:
+        return read_csv(self.data_path, ["sub"], use_cache=use_cache)
 
 
 ROIS = [
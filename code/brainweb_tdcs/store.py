@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import EXPERIMENTS, Experiment
+from .experiments import CATEGORICAL_COLUMNS
+
+INDEX = ["roi", "montage", "variant", "sub", "k_id", "p_id"]
+GEOMETRY_COLUMNS = ["area", "volume", "depth"]
+LOADERS = {"fem": Experiment.get_data, "gpr": Experiment.get_gpr_data}
+
+
+def _get_selection(value: Any) -> Any:
+    # Lists keep the selected levels in the index
+    if value is None:
+        return slice(None)
+    return [value] if np.isscalar(value) else list(value)
+
+
+@dataclass
+class ExperimentStore:
+
+    data: pd.DataFrame
+    experiments: Dict[Tuple[str, str], Experiment]
+
+    @classmethod
+    def load(
+        cls,
+        experiments: Iterable[Experiment] = EXPERIMENTS,
+        variants: Sequence[str] = ("fem", "gpr"),
+        use_cache: Optional[bool] = None,
+        compact: bool = False,
+    ) -> "ExperimentStore":
+        for variant in variants:
+            if variant not in LOADERS:
+                raise ValueError(
+                    f"Unknown variant '{variant}', expected one of {tuple(LOADERS)}."
+                )
+        experiments = {(str(e.roi), e.montage): e for e in experiments}
+        dfs = []
+        for (roi, montage), experiment in experiments.items():
+            for variant in variants:
+                df = LOADERS[variant](experiment, use_cache, compact)
+                dfs.append(df.assign(roi=roi, montage=montage, variant=variant))
+        data = pd.concat(dfs, ignore_index=True)
+        # Levels of the files differ, the cached categories are rebuilt once
+        data["sub"] = np.asarray(data["sub"], dtype=np.int64)
+        for name in CATEGORICAL_COLUMNS:
+            if name in data and name not in INDEX:
+                data[name] = data[name].astype("category")
+        data = data.set_index(INDEX).sort_index()
+        # Geometry of the ROI of each subject joined in a single lookup
+        rois = {str(e.roi): e.roi for e in experiments.values()}
+        geometry = pd.concat(
+            {
+                name: roi.get_data(use_cache).set_index("sub")[GEOMETRY_COLUMNS]
+                for name, roi in rois.items()
+            },
+            names=["roi", "sub"],
+        )
+        geometry.index = geometry.index.set_levels(
+            geometry.index.levels[1].astype(np.int64), level="sub"
+        )
+        keys = pd.MultiIndex.from_arrays(
+            [data.index.get_level_values("roi"), data.index.get_level_values("sub")]
+        )
+        data[GEOMETRY_COLUMNS] = geometry.reindex(keys).values
+        return cls(data, experiments)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get(
+        self, columns: Optional[Sequence[str]] = None, **levels: Any
+    ) -> pd.DataFrame:
+        # Indexed slicing, levels given as values or lists of values
+        unknown = set(levels) - set(INDEX)
+        if unknown:
+            raise ValueError(f"Unknown levels {sorted(unknown)}, expected {INDEX}.")
+        key = tuple(_get_selection(levels.get(n)) for n in INDEX)
+        columns = slice(None) if columns is None else list(columns)
+        return self.data.loc[key, columns]
+
+    def get_experiment_data(
+        self, experiment: Experiment, variant: str = "fem"
+    ) -> pd.DataFrame:
+        # Same layout as Experiment.get_data with the geometry of the ROI
+        return self.data.xs(
+            (str(experiment.roi), experiment.montage, variant),
+            level=["roi", "montage", "variant"],
+        ).reset_index()
+
+    def get_experiments_for_roi(self, roi: str) -> Sequence[Experiment]:
+        return [e for (r, _), e in self.experiments.items() if r == str(roi)]
@@ -1,6 +1,43 @@
-import pymc3 as pm
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import product, repeat
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
 
 from . import EXPERIMENTS, Experiment, RegionOfInterest
+from .cache import evict, get_cache_dir, is_enabled
+from .profiling import profile, write_profile
+
+# Modelling libraries are imported on first use, they take seconds to load
+if TYPE_CHECKING:
+    import arviz as az
+    import bambi as bmb
+    import pymc3 as pm
+
+BACKENDS = ("nuts", "advi", "conjugate", "fast")
+TRACES_CACHE_SIZE = 2**31
+EXECUTION_SETTINGS = ("cores", "progressbar")
+# Settings of the approximate backends, those of the NUTS sampler are ignored
+BACKEND_SETTINGS = {"advi": ("n_iterations", "method"), "conjugate": ()}
+NUTS_SETTINGS = (
+    "tune",
+    "target_accept",
+    "init",
+    "n_init",
+    "discard_tuned_samples",
+    *EXECUTION_SETTINGS,
+)
+VARIANTS = ("fem", "gpr")
+# Log-probability graphs of the PyMC3 random variables
+LOGP_ATTRIBUTES = ("logp_elemwiset", "logp_sum_unscaledt", "logp_nojac_unscaledt")
 
 
 def get_experiments_for_roi(roi: RegionOfInterest) -> Experiment:
@@ -8,7 +45,441 @@ def get_experiments_for_roi(roi: RegionOfInterest) -> Experiment:
 
 
 def log_marginal_likelihood(model, random_seed):
+    import pymc3 as pm
+
+    # Models fitted without pymc3 are not built yet
+    if model.backend is None:
+        model.build()
     with model.backend.model as m:
         return pm.sample_smc(
             1000, random_seed=random_seed
-        ).report.log_marginal_likelihood
\ No newline at end of file
+        ).report.log_marginal_likelihood
+
+
+def get_default_backend() -> str:
+    return os.environ.get("BRAINWEB_TDCS_BACKEND", "nuts")
+
+
+def use_trace_cache_by_default() -> bool:
+    # Independent of the cache of the CSV files, which changes the dtypes
+    return is_enabled("BRAINWEB_TDCS_USE_TRACE_CACHE")
+
+
+def get_traces_cache_size() -> int:
+    return int(os.environ.get("BRAINWEB_TDCS_TRACES_CACHE_SIZE", TRACES_CACHE_SIZE))
+
+
+def _update_digest(digest: "hashlib._Hash", value: Any) -> None:
+    # Functions are hashed by their name and code, their repr changes between
+    # sessions and functions wrapped by the same decorator share their code
+    if isinstance(value, dict):
+        for k in sorted(value, key=str):
+            digest.update(str(k).encode())
+            _update_digest(digest, value[k])
+    elif hasattr(value, "__code__"):
+        for name in ("__module__", "__qualname__"):
+            digest.update(str(getattr(value, name, None)).encode())
+        digest.update(value.__code__.co_code)
+        digest.update(repr(value.__code__.co_consts).encode())
+    else:
+        digest.update(repr(value).encode())
+
+
+def get_model_columns(model: bmb.Model) -> List[str]:
+    formula = str(model.formula)
+    return [
+        c
+        for c in model.data.columns
+        if re.search(rf"(?<!\w){re.escape(str(c))}(?!\w)", formula)
+    ]
+
+
+def get_fit_key(model: bmb.Model, **settings) -> str:
+    import bambi as bmb
+    import pymc3 as pm
+
+    # Only the columns used by the model matter, whatever the data subset
+    data = model.data[get_model_columns(model)]
+    digest = hashlib.sha256()
+    digest.update(str(model.formula).encode())
+    digest.update(str(model.family.name).encode())
+    digest.update(repr(list(data.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    _update_digest(digest, settings)
+    digest.update(f"{bmb.__version__} {pm.__version__}".encode())
+    return digest.hexdigest()
+
+
+def get_backend_settings(backend: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    if backend == "nuts":
+        return settings
+    unknown = set(settings) - {*BACKEND_SETTINGS[backend], *NUTS_SETTINGS}
+    if unknown:
+        raise ValueError(
+            f"Unsupported settings {sorted(unknown)} for the '{backend}' backend."
+        )
+    return {k: v for k, v in settings.items() if k in BACKEND_SETTINGS[backend]}
+
+
+def _store(path: Path, write: Callable[[Path], None]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    write(tmp_path)
+    tmp_path.rename(path)
+    evict(path.parent, get_traces_cache_size())
+
+
+def resolve_backend(model: bmb.Model, backend: Optional[str] = None) -> str:
+    from formulae import design_matrices
+
+    backend = get_default_backend() if backend is None else backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}.")
+    if backend == "fast":
+        pooled = design_matrices(str(model.formula), model.data).group is None
+        backend = "conjugate" if pooled else "advi"
+    return backend
+
+
+def fit_model(
+    model: bmb.Model,
+    draws: int = 1000,
+    chains: int = 4,
+    random_seed: Optional[int] = None,
+    backend: Optional[str] = None,
+    use_cache: Optional[bool] = None,
+    **kwargs,
+) -> az.InferenceData:
+    import arviz as az
+
+    backend = resolve_backend(model, backend)
+    # Ignored settings do not change the fit nor its key
+    kwargs = get_backend_settings(backend, kwargs)
+    if use_cache is None:
+        use_cache = use_trace_cache_by_default()
+    # Fits without a seed are not reproducible and thus not cached
+    if not use_cache or random_seed is None:
+        return _fit_model(model, draws, chains, random_seed, backend, **kwargs)
+    settings = {k: v for k, v in kwargs.items() if k not in EXECUTION_SETTINGS}
+    key = get_fit_key(
+        model,
+        draws=draws,
+        chains=chains,
+        random_seed=random_seed,
+        backend=backend,
+        **settings,
+    )
+    path = get_cache_dir("traces") / f"{key}.nc"
+    if path.exists():
+        path.touch()
+        return az.from_netcdf(path)
+    idata = _fit_model(model, draws, chains, random_seed, backend, **kwargs)
+    # Summaries of the trace are cached under the same key
+    idata.posterior.attrs["fit_key"] = key
+    _store(path, idata.to_netcdf)
+    return idata
+
+
+def summarize(
+    idata: az.InferenceData, use_cache: Optional[bool] = None, **kwargs
+) -> pd.DataFrame:
+    import arviz as az
+
+    key = idata.posterior.attrs.get("fit_key")
+    if use_cache is None:
+        use_cache = use_trace_cache_by_default()
+    if not use_cache or key is None:
+        return az.summary(idata, **kwargs)
+    digest = hashlib.sha256(key.encode())
+    _update_digest(digest, kwargs)
+    path = get_cache_dir("traces") / f"{digest.hexdigest()}.csv"
+    if path.exists():
+        path.touch()
+        return pd.read_csv(path, index_col=0)
+    summary = az.summary(idata, **kwargs)
+    _store(path, summary.to_csv)
+    return summary
+
+
+def _fit_model(
+    model: bmb.Model,
+    draws: int,
+    chains: int,
+    random_seed: Optional[int],
+    backend: str,
+    **kwargs,
+) -> az.InferenceData:
+    # Only the fits themselves are profiled, not the cache hits
+    with profile("study.fit_model", len(model.data), backend=backend):
+        if backend == "nuts":
+            return model.fit(
+                draws=draws, chains=chains, random_seed=random_seed, **kwargs
+            )
+        if backend == "advi":
+            return fit_advi(model, draws, chains, random_seed, **kwargs)
+        return fit_conjugate(model, draws, chains, random_seed, **kwargs)
+
+
+def fit_advi(
+    model: bmb.Model,
+    draws: int = 1000,
+    chains: int = 4,
+    random_seed: Optional[int] = None,
+    n_iterations: int = 30000,
+    method: str = "advi",
+) -> az.InferenceData:
+    import arviz as az
+    import pymc3 as pm
+
+    # Models sharing the graph of another one are already built
+    if model.backend is None:
+        model.build()
+    with model.backend.model:
+        approximation = pm.fit(
+            n_iterations, method=method, random_seed=random_seed, progressbar=False
+        )
+        trace = approximation.sample(draws * chains)
+        idata = az.from_pymc3(trace)
+    # Split the draws into chains so that the output has the usual shape
+    posterior = {}
+    dims = {}
+    for name, values in idata.posterior.data_vars.items():
+        if name.endswith("_offset"):
+            continue
+        posterior[name] = values.values.reshape(chains, draws, *values.shape[2:])
+        dims[name] = list(values.dims[2:])
+    coords = {
+        name: values.values
+        for name, values in idata.posterior.coords.items()
+        if name not in ("chain", "draw")
+    }
+    return az.from_dict(posterior=posterior, coords=coords, dims=dims)
+
+
+def fit_conjugate(
+    model: bmb.Model,
+    draws: int = 1000,
+    chains: int = 4,
+    random_seed: Optional[int] = None,
+) -> az.InferenceData:
+    import arviz as az
+    from formulae import design_matrices
+
+    dm = design_matrices(str(model.formula), model.data)
+    if dm.group is not None:
+        raise ValueError("The conjugate backend only supports pooled models.")
+    # Exact posterior of the gaussian linear model under the p(β, σ) ∝ 1/σ prior
+    x = np.asarray(dm.common.design_matrix, dtype=np.float64)
+    y = np.asarray(dm.response.design_vector, dtype=np.float64).ravel()
+    n, p = x.shape
+    xtx_inv = np.linalg.inv(x.T @ x)
+    beta_hat = xtx_inv @ (x.T @ y)
+    s2 = np.sum((y - x @ beta_hat) ** 2) / (n - p)
+    rng = np.random.default_rng(random_seed)
+    sigma2 = (n - p) * s2 / rng.chisquare(n - p, chains * draws)
+    z = rng.standard_normal((chains * draws, p)) @ np.linalg.cholesky(xtx_inv).T
+    beta = beta_hat + z * np.sqrt(sigma2)[:, np.newaxis]
+    # Name the parameters and their levels as bambi does
+    posterior = {}
+    coords = {}
+    dims = {}
+    for name, info in dm.common.terms_info.items():
+        values = beta[:, info["cols"]].reshape(chains, draws, -1)
+        if "levels" in info:
+            dims[name] = [f"{name}_dim"]
+            coords[f"{name}_dim"] = [
+                level[len(name) + 1 : -1] for level in info["full_names"]
+            ]
+            posterior[name] = values
+        else:
+            posterior[name] = values[..., 0]
+    posterior[f"{dm.response.name}_sigma"] = np.sqrt(sigma2).reshape(chains, draws)
+    return az.from_dict(posterior=posterior, coords=coords, dims=dims)
+
+
+@dataclass
+class FitJob:
+
+    experiment: Experiment
+    formula: str
+    variant: str = "fem"
+    draws: int = 1000
+    chains: int = 4
+    random_seed: Optional[int] = None
+    family: str = "gaussian"
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.variant not in VARIANTS:
+            raise ValueError(
+                f"Unknown data variant '{self.variant}', expected one of {VARIANTS}."
+            )
+
+    def get_data(self) -> pd.DataFrame:
+        if self.variant == "gpr":
+            return self.experiment.get_gpr_data()
+        return self.experiment.get_data()
+
+    def get_model(self) -> bmb.Model:
+        import bambi as bmb
+
+        return bmb.Model(self.formula, self.get_data(), family=self.family)
+
+
+def get_model_constants(model: pm.Model) -> List[Any]:
+    from theano.graph.basic import Constant, ancestors
+
+    # Same order for all the models built from the same formula and family
+    outputs = [getattr(v, a) for v in model.basic_RVs for a in LOGP_ATTRIBUTES]
+    return [v for v in ancestors(outputs) if isinstance(v, Constant)]
+
+
+def get_model_structure(model: pm.Model) -> Tuple:
+    # Models with the same structure only differ by the values of their constants,
+    # i.e. their data and the priors scaled to them
+    rvs = tuple((v.name, np.shape(v.tag.test_value)) for v in model.basic_RVs)
+    constants = tuple((c.type, c.data.shape) for c in get_model_constants(model))
+    return rvs, constants
+
+
+class SharedModel:
+    def __init__(self, model: pm.Model) -> None:
+        self.model = model
+        self.constants = get_model_constants(model)
+        self.shared: Dict[int, Any] = {}
+
+    def _share(self, positions: List[int]) -> None:
+        import theano
+
+        # The constants are replaced by shared variables in the graphs of the random
+        # variables, from which PyMC3 derives the graphs it compiles
+        replace = {}
+        for i in positions:
+            c = self.constants[i]
+            self.shared[i] = theano.shared(
+                c.data.copy(), broadcastable=c.type.broadcastable
+            )
+            replace[c] = self.shared[i]
+        for v in self.model.basic_RVs:
+            graphs = theano.clone_replace(
+                [getattr(v, a) for a in LOGP_ATTRIBUTES], replace
+            )
+            for a, graph in zip(LOGP_ATTRIBUTES, graphs):
+                setattr(v, a, graph)
+
+    def swap(self, model: pm.Model) -> pm.Model:
+        # Data of a model of the same structure swapped into the shared graph, the
+        # constants which differ being turned into shared variables on first use
+        constants = get_model_constants(model)
+        self._share(
+            [
+                i
+                for i, (c, other) in enumerate(zip(self.constants, constants))
+                if i not in self.shared and not np.array_equal(c.data, other.data)
+            ]
+        )
+        for i, shared in self.shared.items():
+            shared.set_value(constants[i].data)
+        # Starting point and observed data of the model, as if it was fitted itself
+        for v, other in zip(self.model.basic_RVs, model.basic_RVs):
+            v.tag.test_value = other.tag.test_value
+            if hasattr(other, "observations"):
+                v.observations = other.observations
+        return self.model
+
+
+def get_notebook_jobs(
+    experiments: Sequence[Experiment] = EXPERIMENTS,
+    variants: Sequence[str] = VARIANTS,
+    vois: Sequence[str] = ("e", "e_r"),
+    random_seed: Optional[int] = 1234,
+) -> List[FitJob]:
+    # Models of the anode placement and conductivity profile notebooks
+    jobs = []
+    for experiment, variant, term, voi in product(
+        experiments, variants, ("C(p_id)", "C(k_id)"), vois
+    ):
+        jobs.append(
+            FitJob(experiment, f"{voi} ~ {term}", variant, random_seed=random_seed)
+        )
+        jobs.append(
+            FitJob(
+                experiment,
+                f"{voi} ~ {term} + ({term} | sub)",
+                variant,
+                random_seed=random_seed,
+                kwargs={"target_accept": 0.9},
+            )
+        )
+    return jobs
+
+
+def _fit_jobs(jobs: List[FitJob], backend: str, cores: int) -> List[str]:
+    # One PyMC3 model per formula, family and structure, fitted on the data of each
+    # job in turn, the conjugate posteriors being computed without PyMC3
+    shared_models = {}
+    keys = []
+    for job in jobs:
+        model = job.get_model()
+        job_backend = resolve_backend(model, backend)
+        if job_backend != "conjugate":
+            model.build()
+            pm_model = model.backend.model
+            structure = (job.formula, job.family, get_model_structure(pm_model))
+            if structure in shared_models:
+                model.backend.model = shared_models[structure].swap(pm_model)
+            else:
+                shared_models[structure] = SharedModel(pm_model)
+        idata = fit_model(
+            model,
+            job.draws,
+            job.chains,
+            job.random_seed,
+            job_backend,
+            use_cache=True,
+            cores=cores,
+            progressbar=False,
+            **job.kwargs,
+        )
+        keys.append(idata.posterior.attrs["fit_key"])
+    # Worker processes exit without running the atexit hooks
+    write_profile()
+    return keys
+
+
+def fit_jobs(
+    jobs: Sequence[FitJob],
+    n_cores: Optional[int] = None,
+    backend: Optional[str] = None,
+    chunks_per_worker: int = 4,
+) -> List[str]:
+    if not jobs:
+        return []
+    # The traces are retrieved from the cache, which requires reproducible fits
+    if any(job.random_seed is None for job in jobs):
+        raise ValueError("Every job must have a random seed.")
+    n_cores = os.cpu_count() if n_cores is None else n_cores
+    backend = get_default_backend() if backend is None else backend
+    # NUTS samples the chains of a job in parallel, the other backends use one core
+    cores = 1
+    if backend == "nuts":
+        cores = max(1, min(max(job.chains for job in jobs), n_cores))
+    n_workers = max(1, n_cores // cores)
+    # Models of the same formula and family are fitted in a row by the same worker,
+    # which shares their graph
+    order = sorted(range(len(jobs)), key=lambda i: (jobs[i].formula, jobs[i].family))
+    n_chunks = min(len(jobs), n_workers * chunks_per_worker)
+    chunks = [list(c) for c in np.array_split(order, n_chunks)]
+    chunk_jobs = [[jobs[i] for i in chunk] for chunk in chunks]
+    if n_workers == 1:
+        results = [_fit_jobs(c, backend, cores) for c in chunk_jobs]
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            results = list(
+                executor.map(_fit_jobs, chunk_jobs, repeat(backend), repeat(cores))
+            )
+    keys = [None] * len(jobs)
+    for chunk, chunk_keys in zip(chunks, results):
+        for i, key in zip(chunk, chunk_keys):
+            keys[i] = key
+    return keys
@@ -0,0 +1,305 @@
+import hashlib
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import partial
+from itertools import repeat
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import sklearn
+from numpy.typing import ArrayLike
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Kernel, Matern
+
+from . import TISSUES
+from .cache import get_cache_dir
+from .experiments import CONDUCTIVITY_COLUMNS
+from .profiling import profiled, write_profile
+
+VOIS = ["e", "e_r", "e_t"]
+
+
+@dataclass
+class Surrogate:
+
+    gpr: GaussianProcessRegressor
+    vois: List[str]
+    placements: List[str]
+    subs: List[int]
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return len(self.vois), len(self.placements), len(self.subs)
+
+    @profiled("surrogate.predict", rows="return")
+    def predict(self, kappas: ArrayLike, batch_size: int = 10000) -> np.ndarray:
+        # (n_kappas, n_vois, n_placements, n_subs)
+        kappas = np.atleast_2d(kappas)
+        out = np.empty((len(kappas), *self.shape))
+        for start in range(0, len(kappas), batch_size):
+            batch = kappas[start : start + batch_size]
+            out[start : start + len(batch)] = self.gpr.predict(batch).reshape(
+                len(batch), *self.shape
+            )
+        return out
+
+    def predict_at(
+        self,
+        kappas: ArrayLike,
+        subs: ArrayLike,
+        placements: ArrayLike,
+        batch_size: int = 10000,
+    ) -> np.ndarray:
+        # (n_kappas, n_vois), one subject and placement per conductivity profile
+        kappas = np.atleast_2d(kappas)
+        s_idx = pd.Index(self.subs).get_indexer(np.asarray(subs))
+        p_idx = pd.Index(self.placements).get_indexer(np.asarray(placements))
+        if (s_idx < 0).any() or (p_idx < 0).any():
+            raise ValueError("Unknown subject or placement.")
+        out = np.empty((len(kappas), len(self.vois)))
+        for start in range(0, len(kappas), batch_size):
+            stop = start + batch_size
+            y = self.predict(kappas[start:stop], batch_size)
+            rows = np.arange(len(y))
+            out[start:stop] = y[rows, :, p_idx[start:stop], s_idx[start:stop]]
+        return out
+
+
+def get_training_set(
+    data: pd.DataFrame, vois: Sequence[str] = VOIS
+) -> Tuple[np.ndarray, np.ndarray, List[str], List[int]]:
+    k_codes, profiles = pd.factorize(data["k"])
+    p_codes, placements = pd.factorize(data["p"])
+    s_codes, subs = pd.factorize(data["sub"])
+    x = data.drop_duplicates("k")[CONDUCTIVITY_COLUMNS].values.astype(np.float64)
+    y = np.full((len(profiles), len(vois), len(placements), len(subs)), np.nan)
+    y[k_codes, :, p_codes, s_codes] = data[list(vois)].values
+    return x, y.reshape(len(profiles), -1), list(placements), list(subs)
+
+
+def get_default_kernel(n_features: int) -> Kernel:
+    return ConstantKernel() * Matern(length_scale=[1.0] * n_features, nu=2.5)
+
+
+def _optimize(
+    x: np.ndarray, y: np.ndarray, kernel: Kernel, alpha: float
+) -> Tuple[float, Kernel]:
+    gpr = GaussianProcessRegressor(kernel=kernel, alpha=alpha)
+    gpr.fit(x, y)
+    return gpr.log_marginal_likelihood_value_, gpr.kernel_
+
+
+def fit_gpr(
+    x: np.ndarray,
+    y: np.ndarray,
+    kernel: Optional[Kernel] = None,
+    alpha: float = 1e-10,
+    n_restarts: int = 10,
+    random_state: int = 0,
+    n_jobs: Optional[int] = 1,
+) -> GaussianProcessRegressor:
+    kernel = get_default_kernel(x.shape[1]) if kernel is None else kernel
+    # Starting points drawn as in sklearn, the first one being the initial kernel
+    rng = np.random.RandomState(random_state)
+    bounds = kernel.bounds
+    thetas = [kernel.theta] + [
+        rng.uniform(bounds[:, 0], bounds[:, 1]) for _ in range(n_restarts)
+    ]
+    kernels = [kernel.clone_with_theta(theta) for theta in thetas]
+    # Restarts run in a process pool on request only, the problems are small
+    if n_jobs == 1:
+        results = [_optimize(x, y, k, alpha) for k in kernels]
+    else:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            results = list(
+                executor.map(_optimize, repeat(x), repeat(y), kernels, repeat(alpha))
+            )
+    _, best_kernel = max(results, key=lambda r: r[0])
+    # Single factorization shared by all the outputs
+    return GaussianProcessRegressor(
+        kernel=best_kernel, alpha=alpha, optimizer=None
+    ).fit(x, y)
+
+
+def get_surrogate_key(
+    x: np.ndarray, y: np.ndarray, kernel: Kernel, **parameters
+) -> str:
+    digest = hashlib.sha256()
+    for array in (x, y):
+        digest.update(str(array.shape).encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(repr(kernel).encode())
+    digest.update(repr(sorted(parameters.items())).encode())
+    digest.update(sklearn.__version__.encode())
+    return digest.hexdigest()
+
+
+@profiled("surrogate.fit", rows="data")
+def fit_surrogate(
+    data: pd.DataFrame,
+    vois: Sequence[str] = VOIS,
+    kernel: Optional[Kernel] = None,
+    alpha: float = 1e-10,
+    n_restarts: int = 10,
+    random_state: int = 0,
+    n_jobs: Optional[int] = 1,
+    use_cache: bool = True,
+) -> Surrogate:
+    x, y, placements, subs = get_training_set(data, vois)
+    kernel = get_default_kernel(x.shape[1]) if kernel is None else kernel
+    key = get_surrogate_key(
+        x,
+        y,
+        kernel,
+        vois=list(vois),
+        alpha=alpha,
+        n_restarts=n_restarts,
+        random_state=random_state,
+    )
+    path = get_cache_dir("surrogates") / f"{key}.pkl" if use_cache else None
+    if use_cache and path.exists():
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    surrogate = Surrogate(
+        fit_gpr(x, y, kernel, alpha, n_restarts, random_state, n_jobs),
+        list(vois),
+        placements,
+        subs,
+    )
+    if use_cache:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Concurrent writers of the same surrogate each use their own file
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(surrogate, f)
+        tmp_path.rename(path)
+    return surrogate
+
+
+def get_halton_profiles(n_profiles: int = 20, random_seed: int = 1234) -> np.ndarray:
+    import chaospy as cp
+
+    # (n_profiles, n_tissues) realistic profiles sampled through the inverse CDF of
+    # the tissues at Halton points, the same for all the experiments
+    dist = cp.J(*[cp.Uniform(0, 1) for _ in range(len(TISSUES))])
+    cdfs = dist.sample(n_profiles, rule="halton", seed=random_seed)
+    return np.stack([t.ppf(cdf) for cdf, t in zip(cdfs, TISSUES.values())], axis=1)
+
+
+def get_gpr_profiles(
+    data: pd.DataFrame,
+    n_profiles: int = 20,
+    random_seed: int = 1234,
+    halton: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    # Reference profile of the experiment followed by the Halton profiles
+    if halton is None:
+        halton = get_halton_profiles(n_profiles, random_seed)
+    kappa = data.drop_duplicates("k")[["k", *CONDUCTIVITY_COLUMNS]].copy()
+    for i, name in enumerate(CONDUCTIVITY_COLUMNS):
+        kappa[name] = np.hstack(([kappa[name].values[0]], halton[:, i]))
+    return kappa
+
+
+@profiled("surrogate.generate_gpr_data", rows="data")
+def generate_gpr_data(
+    data: pd.DataFrame,
+    vois: Sequence[str] = VOIS,
+    n_profiles: int = 20,
+    random_seed: int = 1234,
+    halton: Optional[np.ndarray] = None,
+    **kwargs,
+) -> pd.DataFrame:
+    kappa = get_gpr_profiles(data, n_profiles, random_seed, halton)
+    surrogate = fit_surrogate(data, vois, **kwargs)
+    n_sub, n_p = len(surrogate.subs), len(surrogate.placements)
+    y_gpr = surrogate.predict(kappa[CONDUCTIVITY_COLUMNS].values)
+    gpr_data = pd.DataFrame(
+        dict(
+            sub=data["sub"].values.ravel(),
+            k=data["k"].values.ravel(),
+            k_id=data["k_id"].values.ravel(),
+            **{
+                name: np.tile(np.repeat(kappa[name].values.ravel(), n_p), n_sub)
+                for name in CONDUCTIVITY_COLUMNS
+            },
+            p=data["p"].values.ravel(),
+            p_id=data["p_id"].values.ravel(),
+        )
+    )
+    for i, voi in enumerate(vois):
+        # (k, p, sub) -> (sub, k, p) as in the original data
+        gpr_data[voi] = y_gpr[:, i].transpose(2, 0, 1).ravel()
+    return gpr_data
+
+
+def _generate_gpr_file(
+    path: Path,
+    output_path: Path,
+    vois: Sequence[str],
+    halton: np.ndarray,
+    kwargs: Dict[str, Any],
+) -> Path:
+    data = pd.read_csv(path, sep=";")
+    gpr_data = generate_gpr_data(data, vois, halton=halton, **kwargs)
+    gpr_data.to_csv(output_path, sep=";", index=False)
+    # Worker processes exit without running the atexit hooks
+    write_profile()
+    return output_path
+
+
+def generate_gpr_files(
+    paths: Iterable[Union[str, Path]],
+    output_dir: Optional[Union[str, Path]] = None,
+    vois: Sequence[str] = VOIS,
+    n_profiles: int = 20,
+    random_seed: int = 1234,
+    n_workers: Optional[int] = None,
+    callback: Optional[Callable[[Path, Path], None]] = None,
+    **kwargs,
+) -> List[Path]:
+    # <name>.csv -> <name>_gpr.csv of all the experiments in a single job, the
+    # callback receiving the input and output paths of each generated file
+    paths = [Path(p) for p in paths]
+    outputs = [
+        (p.parent if output_dir is None else Path(output_dir)) / f"{p.stem}_gpr.csv"
+        for p in paths
+    ]
+    halton = get_halton_profiles(n_profiles, random_seed)
+    # Processes used by the job, over the experiments or else over the restarts
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    errors = []
+
+    def done(path: Path, output_path: Path, run: Callable[[], Path]) -> None:
+        # A failing experiment does not prevent generating the other ones
+        try:
+            run()
+        except Exception as e:
+            errors.append(e)
+            return
+        if callback is not None:
+            callback(path, output_path)
+
+    if n_workers <= 1 or len(paths) <= 1:
+        kwargs.setdefault("n_jobs", n_workers)
+        for p, o in zip(paths, outputs):
+            done(p, o, partial(_generate_gpr_file, p, o, vois, halton, kwargs))
+    else:
+        # Experiments fitted in parallel, the restarts of each fit being run
+        # sequentially rather than in nested pools
+        kwargs.setdefault("n_jobs", 1)
+        with ProcessPoolExecutor(min(n_workers, len(paths))) as executor:
+            futures = {
+                executor.submit(_generate_gpr_file, p, o, vois, halton, kwargs): (p, o)
+                for p, o in zip(paths, outputs)
+            }
+            for future in as_completed(futures):
+                done(*futures[future], future.result)
+    if errors:
+        raise errors[0]
+    return outputs
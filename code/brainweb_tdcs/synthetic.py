@@ -0,0 +1,262 @@
+import argparse
+import re
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Union
+
+import duckdb
+
+from . import EXPERIMENTS, ROIS, TISSUES
+from .extraction import ANODE_SUFFIXES, FIELD_COLUMNS, ExperimentSpec
+
+EXPERIMENT_SPECS = [(str(e.roi), e.anode, e.cathode) for e in EXPERIMENTS]
+# Approximate size of a record of full_records, DuckDB files are smaller once compressed
+RECORD_SIZE = 100
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(size: str) -> int:
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?\s*", size.upper())
+    if match is None:
+        raise ValueError(f"Invalid size '{size}', expected e.g. '500MB' or '10GB'.")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def get_n_records(
+    n_experiments: int, n_subjects: int, n_profiles: int, n_placements: int
+) -> int:
+    # Records of each element of the ROIs
+    return n_experiments * n_subjects * n_profiles * n_placements
+
+
+def get_n_elements(
+    size: int,
+    n_experiments: int = len(EXPERIMENT_SPECS),
+    n_subjects: int = 20,
+    n_profiles: int = 21,
+    n_placements: int = len(ANODE_SUFFIXES),
+) -> int:
+    n_records = get_n_records(n_experiments, n_subjects, n_profiles, n_placements)
+    return max(1, size // (RECORD_SIZE * n_records))
+
+
+def create_tables(conn: duckdb.DuckDBPyConnection) -> None:
+    fields = ",\n".join(f"{f} REAL" for f in ["v", *FIELD_COLUMNS])
+    conn.execute(
+        f"""
+        CREATE TABLE full_records (
+            roi VARCHAR,
+            cathode VARCHAR,
+            subject INTEGER,
+            anode VARCHAR,
+            conductivity_profile INTEGER,
+            element INTEGER,
+            {fields}
+        )
+        """
+    )
+    tissues = ", ".join(f"{t.lower()} REAL" for t in TISSUES)
+    conn.execute(f"CREATE TABLE conductivity_profiles (id INTEGER, {tissues})")
+    conn.execute(
+        """
+        CREATE TABLE full_roi_profiles (
+            name VARCHAR,
+            subject INTEGER,
+            x DOUBLE,
+            y DOUBLE,
+            z DOUBLE,
+            area DOUBLE,
+            volume DOUBLE,
+            depth DOUBLE
+        )
+        """
+    )
+
+
+def insert_conductivity_profiles(
+    conn: duckdb.DuckDBPyConnection, n_profiles: int
+) -> None:
+    # The last profile is the reference one, the others are drawn uniformly
+    tissues = ",\n".join(
+        f"""
+        CASE WHEN range = {n_profiles - 1} THEN {t.k_mean}
+        ELSE {t.k_min} + random() * {t.k_max - t.k_min} END
+        """
+        for t in TISSUES.values()
+    )
+    conn.execute(
+        f"""
+        INSERT INTO conductivity_profiles
+        SELECT range, {tissues} FROM range({n_profiles})
+        """
+    )
+
+
+def insert_roi_profiles(
+    conn: duckdb.DuckDBPyConnection, rois: Iterable[str], n_subjects: int
+) -> None:
+    for roi in rois:
+        conn.execute(
+            f"""
+            INSERT INTO full_roi_profiles
+            SELECT
+                '{roi}',
+                range,
+                (random() - 0.5) * 100,
+                (random() - 0.5) * 100,
+                (random() - 0.5) * 100,
+                1000 + random() * 9000,
+                3000 + random() * 27000,
+                20 + random() * 20
+            FROM range({n_subjects})
+            """
+        )
+
+
+def insert_records(
+    conn: duckdb.DuckDBPyConnection,
+    experiments: Sequence[ExperimentSpec],
+    subject: int,
+    n_elements: int,
+    n_profiles: int,
+    n_placements: int,
+) -> None:
+    anodes = ", ".join(
+        f"('{roi}', '{anode}{suffix}', '{cathode}')"
+        for roi, anode, cathode in experiments
+        for suffix in ANODE_SUFFIXES[:n_placements]
+    )
+    # Field in V/m and current density in A/m², consistent with their components
+    conn.execute(
+        f"""
+        INSERT INTO full_records
+        SELECT
+            roi,
+            cathode,
+            {subject},
+            anode,
+            conductivity_profile,
+            element,
+            v,
+            sqrt(e_x * e_x + e_y * e_y + e_z * e_z),
+            e_x,
+            e_y,
+            e_z,
+            e_z,
+            sqrt(e_x * e_x + e_y * e_y),
+            0.3 * sqrt(e_x * e_x + e_y * e_y + e_z * e_z),
+            0.3 * e_x,
+            0.3 * e_y,
+            0.3 * e_z,
+            0.3 * e_z,
+            0.3 * sqrt(e_x * e_x + e_y * e_y)
+        FROM (
+            SELECT
+                a.roi,
+                a.cathode,
+                a.anode,
+                k.range AS conductivity_profile,
+                r.range AS element,
+                (random() - 0.5) * 0.2 AS v,
+                (random() - 0.5) * 0.4 AS e_x,
+                (random() - 0.5) * 0.4 AS e_y,
+                (random() - 0.5) * 0.4 AS e_z
+            FROM
+                (VALUES {anodes}) AS a(roi, anode, cathode),
+                range({n_profiles}) AS k,
+                range({n_elements}) AS r
+        )
+        """
+    )
+
+
+def create_synthetic_database(
+    db_path: Union[str, Path],
+    experiments: Sequence[ExperimentSpec] = EXPERIMENT_SPECS,
+    n_subjects: int = 20,
+    n_elements: int = 1000,
+    n_profiles: int = 21,
+    n_placements: int = len(ANODE_SUFFIXES),
+    seed: Optional[float] = None,
+    threads: int = 8,
+    memory_limit: str = "8GB",
+) -> Path:
+    if not 1 <= n_placements <= len(ANODE_SUFFIXES):
+        raise ValueError(
+            f"Number of placements must be between 1 and {len(ANODE_SUFFIXES)}."
+        )
+    db_path = Path(db_path)
+    if db_path.exists():
+        raise ValueError(f"Database '{db_path}' already exists.")
+    conn = duckdb.connect(str(db_path))
+    # The random values only follow the seed when they are drawn by a single thread
+    if seed is not None:
+        threads = 1
+    conn.execute(f"PRAGMA threads={int(threads)}")
+    conn.execute(f"PRAGMA memory_limit='{memory_limit}'")
+    if seed is not None:
+        conn.execute(f"SELECT setseed({float(seed)})")
+    create_tables(conn)
+    insert_conductivity_profiles(conn, n_profiles)
+    insert_roi_profiles(conn, sorted({roi for roi, _, _ in experiments}), n_subjects)
+    # One subject at a time so that the inserts of large databases stay bounded
+    for subject in range(n_subjects):
+        insert_records(conn, experiments, subject, n_elements, n_profiles, n_placements)
+    conn.close()
+    return db_path
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic database with the schema of brainweb-tdcs.db."
+    )
+    parser.add_argument("db_path", type=Path)
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument(
+        "--size", type=parse_size, help="approximate size of the records (e.g. 10GB)"
+    )
+    size.add_argument("--n-elements", type=int, default=1000)
+    parser.add_argument("--n-subjects", type=int, default=20)
+    parser.add_argument("--n-profiles", type=int, default=21)
+    parser.add_argument(
+        "--n-placements", type=int, default=len(ANODE_SUFFIXES), choices=range(1, 6)
+    )
+    parser.add_argument(
+        "--rois",
+        nargs="+",
+        choices=[str(r) for r in ROIS],
+        help="ROIs of the experiments (all by default)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=float,
+        help="seed of the random values, between -1 and 1 (single-threaded inserts)",
+    )
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--memory-limit", default="8GB")
+    args = parser.parse_args(argv)
+    experiments = [e for e in EXPERIMENT_SPECS if not args.rois or e[0] in args.rois]
+    n_elements = args.n_elements
+    if args.size is not None:
+        n_elements = get_n_elements(
+            args.size,
+            len(experiments),
+            args.n_subjects,
+            args.n_profiles,
+            args.n_placements,
+        )
+    create_synthetic_database(
+        args.db_path,
+        experiments,
+        args.n_subjects,
+        n_elements,
+        args.n_profiles,
+        args.n_placements,
+        args.seed,
+        args.threads,
+        args.memory_limit,
+    )
+    print(args.db_path)
+
+
+if __name__ == "__main__":
+    main()
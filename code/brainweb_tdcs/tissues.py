@@ -1,7 +1,17 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+from .profiling import profiled
 
-import chaospy as cp
-from scipy.stats import truncnorm
+# chaospy and scipy are imported on first use, the package is often imported for
+# the experiments and regions of interest only
+if TYPE_CHECKING:
+    import chaospy as cp
 
 
 @dataclass
@@ -16,16 +26,31 @@ class Tissue:
 
     @property
     def k(self) -> cp.Distribution:
+        import chaospy as cp
+
         return cp.TruncNormal(self.k_min, self.k_max, self.k_mean, self.k_std)
 
     @property
     def k_norm(self) -> cp.Distribution:
+        import chaospy as cp
+
         return cp.Normal(self.k_mean, self.k_std)
-    
+
     @property
     def k_uni(self) -> cp.Distribution:
+        import chaospy as cp
+
         return cp.Uniform(self.k_min, self.k_max)
 
+    @profiled("tissues.ppf", rows="q")
+    def ppf(self, q: ArrayLike) -> np.ndarray:
+        from scipy.stats import truncnorm
+
+        # Exact inverse of the CDF of the truncated normal distribution
+        a = (self.k_min - self.k_mean) / self.k_std
+        b = (self.k_max - self.k_mean) / self.k_std
+        return truncnorm.ppf(q, a, b, loc=self.k_mean, scale=self.k_std)
+
 
 TISSUES = {
     "WM": Tissue("white matter", 0.0646, 0.81, 0.2167, 0.1703, "#440154"),
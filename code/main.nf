@@ -1,76 +1,92 @@
-experimentCh = Channel
-    .fromList( [
-        ['MC', 'C3', 'C4'],
-        ['MC', 'C3', 'Fp2'],
-        ['dlPFC', 'F3', 'F4'],
-        ['dlPFC', 'F3', 'Fp2'],
-        ['vmPFC', 'F7', 'F8'],
-        ['IPS', 'P3', 'P4']
-    ] )
-    .combine(
-        Channel
-            .fromPath( "${launchDir}/inputs/voi/results/brainweb-tdcs.db" )
-    )
+EXPERIMENTS = [
+    ['MC', 'C3', 'C4'],
+    ['MC', 'C3', 'Fp2'],
+    ['dlPFC', 'F3', 'F4'],
+    ['dlPFC', 'F3', 'Fp2'],
+    ['vmPFC', 'F7', 'F8'],
+    ['IPS', 'P3', 'P4']
+]
+ROIS = ['MC', 'dlPFC', 'vmPFC', 'IPS']
+
+Channel
+    .fromPath( "${launchDir}/inputs/voi/results/brainweb-tdcs.db" )
+    .into { dbCh1; dbCh2; dbCh3 }
+
 process extract_experiments_results {
-    tag "roi: ${roi}, anode: ${anode}, cathode: ${cathode}"
-    label 'duckdb'
+    tag "experiments: ${experiments}"
+    label 'python'
     publishDir "${launchDir}/data/experiments", mode: 'copy'
 
     input:
-    tuple roi, anode, cathode, file(db: "brainweb-tdcs.db") \
-        from experimentCh
+    val experiments from Channel.value( EXPERIMENTS.collect { it.join(',') }.join(';') )
+    file(db: "brainweb-tdcs.db") from dbCh1
 
     output:
-    tuple roi, anode, cathode, "roi-${roi}_anode-${anode}_cathode-${cathode}.csv" \
-        into experimentCsvCh
-    
+    file "roi-*.csv" into experimentCsvFilesCh
+
     script:
-    template 'extract_experiments_results.py'
+    template 'extract_all_experiments_results.py'
+}
+
+process extract_experiments_statistics {
+    tag "experiments: ${experiments}"
+    label 'python'
+    publishDir "${launchDir}/data/experiments", mode: 'copy'
+
+    when:
+    params.statistics
+
+    input:
+    val experiments from Channel.value( EXPERIMENTS.collect { it.join(',') }.join(';') )
+    file(db: "brainweb-tdcs.db") from dbCh3
+
+    output:
+    file "roi-*_stats.csv" into experimentStatsCsvCh
+
+    script:
+    template 'extract_all_experiments_statistics.py'
 }
 
-roiCh = Channel
-    .fromList( ['MC', 'dlPFC', 'vmPFC', 'IPS'] )
-    .combine(
-        Channel
-            .fromPath( "${launchDir}/inputs/voi/results/brainweb-tdcs.db" )
-    )
 process extract_rois_results {
-    tag "roi: ${roi}"
-    label 'duckdb'
+    tag "rois: ${rois}"
+    label 'python'
     publishDir "${launchDir}/data/rois", mode: 'copy'
 
     input:
-    tuple roi, file(db: 'brainweb-tdcs.db') \
-        from roiCh
-    
+    val rois from Channel.value( ROIS.join(',') )
+    file(db: 'brainweb-tdcs.db') from dbCh2
+
     output:
-    tuple roi, "roi-${roi}.csv" \
-        into roiCsvCh
-    
+    file "roi-*.csv" into roiCsvCh
+
     script:
-    template 'extract_rois_results.py'
+    template 'extract_all_rois_results.py'
 }
 
 process generate_experiments_results {
-    tag "roi: ${roi}, anode: ${anode}, cathode: ${cathode}"
+    tag "experiments: ${EXPERIMENTS.size()}"
     label 'python'
+    cpus params.gpr_cpus
     publishDir "${launchDir}/data/experiments", mode: 'copy'
 
     input:
-    tuple roi, anode, cathode, file(csv: "data.csv") \
-        from experimentCsvCh
-    
+    file(csvs) from experimentCsvFilesCh
+
     output:
-    tuple roi, anode, cathode, "roi-${roi}_anode-${anode}_cathode-${cathode}_gpr.csv" \
-        into experimentGprCsvCh
-    tuple roi, anode, cathode \
-        into generatedFlagCh
+    file "roi-*_gpr.csv" into experimentGprCsvFilesCh
 
     script:
-    template 'generate_experiments_results.py'
+    template 'generate_all_experiments_results.py'
 }
 
-generatedFlagCh.into { generatedFlagCh1; generatedFlagCh2; generatedFlagCh3; generatedFlagCh4; generatedFlagCh5 }
+generatedFlagCh = experimentGprCsvFilesCh
+    .flatten()
+    .map { csv ->
+        def m = csv.name =~ /roi-([^_]+)_anode-([^_]+)_cathode-([^_]+)_gpr\.csv/
+        tuple(m[0][1], m[0][2], m[0][3])
+    }
+
+generatedFlagCh.into { generatedFlagCh1; generatedFlagCh2; generatedFlagCh3; generatedFlagCh4; generatedFlagCh5; generatedFlagCh6 }
 
 Channel
     .fromList(
@@ -97,6 +113,9 @@ process convert_anode_placement_notebook {
     label 'python'
     publishDir "${launchDir}/results/html", mode: 'copy'
 
+    when:
+    !params.headless_reports
+
     input:
     tuple roi, anode, cathode, id, file(notebook: "anode_placement.ipynb"), use_gpr \
         from anodePlacementNotebookCh
@@ -109,6 +128,7 @@ process convert_anode_placement_notebook {
     '''
     export BRAINWEB_TDCS_CODE_DIR="!{launchDir}/code"
     export BRAINWEB_TDCS_DATA_DIR="!{launchDir}/data"
+    export BRAINWEB_TDCS_USE_TRACE_CACHE=1
     export NOTEBOOK="!{notebook.baseName}_roi-!{roi}_anode-!{anode}_cathode-!{cathode}!{(use_gpr) ? '_gpr' : ''}.ipynb"
     papermill !{notebook} ${NOTEBOOK} -p experiment_id !{id} -p use_gpr !{use_gpr}
     jupyter nbconvert ${NOTEBOOK} --to html \
@@ -134,6 +154,9 @@ process convert_conductivity_profile_notebook {
     label 'python'
     publishDir "${launchDir}/results/html", mode: 'copy'
 
+    when:
+    !params.headless_reports
+
     input:
     tuple roi, anode, cathode, id, file(notebook: "conductivity_profile.ipynb"), use_gpr \
         from conductivityProfileNotebookCh
@@ -146,6 +169,7 @@ process convert_conductivity_profile_notebook {
     '''
     export BRAINWEB_TDCS_CODE_DIR="!{launchDir}/code"
     export BRAINWEB_TDCS_DATA_DIR="!{launchDir}/data"
+    export BRAINWEB_TDCS_USE_TRACE_CACHE=1
     export NOTEBOOK="!{notebook.baseName}_roi-!{roi}_anode-!{anode}_cathode-!{cathode}!{(use_gpr) ? '_gpr' : ''}.ipynb"
     papermill !{notebook} ${NOTEBOOK} -p experiment_id !{id} -p use_gpr !{use_gpr}
     jupyter nbconvert ${NOTEBOOK} --to html \
@@ -174,6 +198,9 @@ process convert_bipolar_unipolar_notebook {
     label 'python'
     publishDir "${launchDir}/results/html", mode: 'copy'
 
+    when:
+    !params.headless_reports
+
     input:
     tuple roi, id, file(notebook: "bipolar_unipolar.ipynb"), use_gpr, a1, a2, c1, c2 \
         from bipolarUnipolarNotebookCh
@@ -186,6 +213,7 @@ process convert_bipolar_unipolar_notebook {
     '''
     export BRAINWEB_TDCS_CODE_DIR="!{launchDir}/code"
     export BRAINWEB_TDCS_DATA_DIR="!{launchDir}/data"
+    export BRAINWEB_TDCS_USE_TRACE_CACHE=1
     export NOTEBOOK="!{notebook.baseName}_roi-!{roi}!{(use_gpr) ? '_gpr' : ''}.ipynb"
     papermill !{notebook} ${NOTEBOOK} -p roi_id !{id} -p use_gpr !{use_gpr}
     jupyter nbconvert ${NOTEBOOK} --to html \
@@ -212,6 +240,9 @@ process convert_induced_transmembrane_potential_notebook {
     label 'python'
     publishDir "${launchDir}/results/html", mode: 'copy'
 
+    when:
+    !params.headless_reports
+
     input:
     tuple roi, anode, cathode, id, file(notebook: "induced_transmembrane_potential.ipynb"), use_gpr \
         from inducedPotentialNotebookCh
@@ -224,6 +255,7 @@ process convert_induced_transmembrane_potential_notebook {
     '''
     export BRAINWEB_TDCS_CODE_DIR="!{launchDir}/code"
     export BRAINWEB_TDCS_DATA_DIR="!{launchDir}/data"
+    export BRAINWEB_TDCS_USE_TRACE_CACHE=1
     export NOTEBOOK="!{notebook.baseName}_roi-!{roi}_anode-!{anode}_cathode-!{cathode}!{(use_gpr) ? '_gpr' : ''}.ipynb"
     papermill !{notebook} ${NOTEBOOK} -p experiment_id !{id} -p use_gpr !{use_gpr}
     jupyter nbconvert ${NOTEBOOK} --to html \
@@ -250,6 +282,9 @@ process convert_subject_notebook {
     label 'python'
     publishDir "${launchDir}/results/html", mode: 'copy'
 
+    when:
+    !params.headless_reports
+
     input:
     tuple roi, anode, cathode, id, file(notebook: "subject.ipynb"), use_gpr \
         from subjectNotebookCh
@@ -262,6 +297,7 @@ process convert_subject_notebook {
     '''
     export BRAINWEB_TDCS_CODE_DIR="!{launchDir}/code"
     export BRAINWEB_TDCS_DATA_DIR="!{launchDir}/data"
+    export BRAINWEB_TDCS_USE_TRACE_CACHE=1
     export NOTEBOOK="!{notebook.baseName}_roi-!{roi}_anode-!{anode}_cathode-!{cathode}!{(use_gpr) ? '_gpr' : ''}.ipynb"
     papermill !{notebook} ${NOTEBOOK} -p experiment_id !{id} -p use_gpr !{use_gpr}
     jupyter nbconvert ${NOTEBOOK} --to html \
@@ -273,3 +309,26 @@ process convert_subject_notebook {
         --allow-chromium-download
     '''
 }
+
+process render_reports {
+    label 'python'
+    publishDir "${launchDir}/results/html", mode: 'copy'
+
+    when:
+    params.headless_reports
+
+    input:
+    val flags from generatedFlagCh6.collect()
+
+    output:
+    path "*.html" into htmlReportsCh
+
+    shell:
+    '''
+    export BRAINWEB_TDCS_CODE_DIR="!{launchDir}/code"
+    export BRAINWEB_TDCS_DATA_DIR="!{launchDir}/data"
+    export BRAINWEB_TDCS_USE_TRACE_CACHE=1
+    export PYTHONPATH="!{launchDir}/code${PYTHONPATH:+:$PYTHONPATH}"
+    python -m brainweb_tdcs.report --notebooks-dir "!{launchDir}/notebooks" --output-dir .
+    '''
+}
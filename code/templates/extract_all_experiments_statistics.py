@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import sys
+
+# Nextflow input parameters
+EXPERIMENTS = [tuple(e.split(",")) for e in "${experiments}".split(";")]
+DB_PATH = Path("${db}")
+MEMORY_LIMIT = "${task.memory ? task.memory.toGiga() + 'GB' : '8GB'}"
+BRAINWEB_TDCS_CODE_DIR = "${launchDir}/code"
+sys.path.append(BRAINWEB_TDCS_CODE_DIR)
+
+from brainweb_tdcs.extraction import extract_experiments_statistics
+
+
+if __name__ == "__main__":
+    extract_experiments_statistics(DB_PATH, EXPERIMENTS, memory_limit=MEMORY_LIMIT)
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import sys
+
+# Nextflow input parameters
+ROIS = "${rois}".split(",")
+DB_PATH = Path("${db}")
+BRAINWEB_TDCS_CODE_DIR = "${launchDir}/code"
+sys.path.append(BRAINWEB_TDCS_CODE_DIR)
+
+from brainweb_tdcs.extraction import extract_rois_results
+
+
+if __name__ == "__main__":
+    extract_rois_results(DB_PATH, ROIS)
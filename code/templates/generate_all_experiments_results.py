@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import os
+from pathlib import Path
+import sys
+
+# Nextflow input parameters
+CSV_PATHS = [Path(p) for p in "${csvs}".split()]
+N_WORKERS = int("${task.cpus}")
+BRAINWEB_TDCS_CODE_DIR = "${launchDir}/code"
+sys.path.append(BRAINWEB_TDCS_CODE_DIR)
+# Fitted surrogates are cached in the data directory across runs
+os.environ.setdefault("BRAINWEB_TDCS_DATA_DIR", "${launchDir}/data")
+
+from brainweb_tdcs.surrogate import generate_gpr_files
+
+RANDOM_SEED = 1234
+VOIS = ["e", "e_r", "e_t"]
+
+
+if __name__ == "__main__":
+    generate_gpr_files(
+        CSV_PATHS, ".", VOIS, random_seed=RANDOM_SEED, n_workers=N_WORKERS
+    )